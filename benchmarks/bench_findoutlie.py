@@ -0,0 +1,185 @@
+""" Benchmark findoutlie hot paths on synthetic data
+
+Run as:
+
+    python3 benchmarks/bench_findoutlie.py
+    python3 benchmarks/bench_findoutlie.py --shape 96 96 60 300 --dtype float32
+    python3 benchmarks/bench_findoutlie.py --cases dvars spm_globals --json
+
+Each benchmark runs in a new process, so the peak resident set size (RSS) is
+for that benchmark alone.  We report the best wall time over the repeats, the
+peak RSS of the process, and the increase in peak RSS over the process after
+imports and setup.
+"""
+
+from functools import partial
+from pathlib import Path
+import json
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+
+# Put the findoutlie and benchmarks directories on the Python path.
+BENCH_DIR = Path(__file__).parent
+sys.path.append(str(BENCH_DIR / '..'))
+sys.path.append(str(BENCH_DIR))
+
+import numpy as np
+
+from synthetic import make_data_directory
+
+
+def _run_dvars(fnames):
+    from findoutlie.metrics import dvars
+    for fname in fnames:
+        dvars(fname)
+
+
+def _run_spm_globals(fnames):
+    from findoutlie.spm_funcs import get_spm_globals
+    for fname in fnames:
+        get_spm_globals(fname)
+
+
+def _run_detect_outliers(fnames):
+    from findoutlie.outfind import detect_outliers
+    for fname in fnames:
+        detect_outliers(fname)
+
+
+def _run_pca_variance(fnames, method):
+    from findoutlie.engine import compute_metrics
+    for fname in fnames:
+        compute_metrics(fname, ['pca_variance'], pca_method=method)
+
+
+def _run_compute_metrics(fnames, prefetch=0, mask=None):
+    from findoutlie.engine import compute_metrics
+    for fname in fnames:
+        compute_metrics(fname, prefetch=prefetch, mask=mask)
+
+
+def _run_file_hash(fnames):
+    from findoutlie.utils import file_hash
+    for fname in fnames:
+        file_hash(fname)
+
+
+def _run_validate_data(fnames):
+    from findoutlie.utils import logger, validate_data
+    logger.setLevel('WARNING')
+    data_directory = Path(fnames[0]).parents[2]
+    validate_data(data_directory, use_cache=False)
+
+
+CASES = {
+    'dvars': _run_dvars,
+    'spm_globals': _run_spm_globals,
+    'detect_outliers': _run_detect_outliers,
+    'pca_eigh': partial(_run_pca_variance, method='eigh'),
+    'pca_power': partial(_run_pca_variance, method='power'),
+    'compute_metrics': _run_compute_metrics,
+    'compute_metrics_prefetch': partial(_run_compute_metrics, prefetch=2),
+    'compute_metrics_mask': partial(_run_compute_metrics, mask='auto'),
+    'file_hash': _run_file_hash,
+    'validate_data': _run_validate_data,
+}
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kB on Linux, bytes on macOS.
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+
+def _bench_child(case, fnames, repeat, queue):
+    # Import everything before the baseline RSS measurement.
+    import findoutlie.engine, findoutlie.outfind, findoutlie.utils  # noqa
+    base_rss = _peak_rss_mb()
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        CASES[case](fnames)
+        times.append(time.perf_counter() - start)
+    peak_rss = _peak_rss_mb()
+    queue.put({'case': case, 'time': min(times), 'peak_rss_mb': peak_rss,
+               'delta_rss_mb': peak_rss - base_rss})
+
+
+def run_benchmark(case, fnames, repeat=3):
+    """ Run benchmark `case` on `fnames` in a new process, return results
+    """
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_bench_child,
+                              args=(case, fnames, repeat, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def get_parser():
+    parser = ArgumentParser(description=__doc__,  # Usage from docstring
+                            formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument('--shape', type=int, nargs=4,
+                        default=[64, 64, 30, 200],
+                        help='Shape of synthetic 4D images')
+    parser.add_argument('--dtype', default='int16',
+                        help='Data type of synthetic images on disk')
+    parser.add_argument('--n-runs', type=int, default=2,
+                        help='Number of synthetic images')
+    parser.add_argument('--no-compress', action='store_true',
+                        help='Use .nii rather than .nii.gz images '
+                        '(not for validate_data)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of times to repeat each benchmark')
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES),
+                        default=list(CASES),
+                        help='Benchmarks to run')
+    parser.add_argument('--json', action='store_true',
+                        help='Print results as JSON lines')
+    return parser
+
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fnames = make_data_directory(tmp_dir, n_runs=args.n_runs,
+                                     shape=args.shape,
+                                     dtype=np.dtype(args.dtype))
+        if args.no_compress:
+            import nibabel as nib
+            nii_fnames = []
+            for fname in fnames:
+                nii_fname = Path(str(fname)[:-3])
+                nib.save(nib.load(fname), str(nii_fname))
+                nii_fnames.append(nii_fname)
+            fnames = nii_fnames
+        fnames = [str(fname) for fname in fnames]
+        if not args.json:
+            print(f'{args.n_runs} images, shape {tuple(args.shape)}, '
+                  f'{args.dtype}, {"un" if args.no_compress else ""}'
+                  'compressed')
+            print(f'{"case":<26}{"time (s)":>10}{"peak RSS (MB)":>15}'
+                  f'{"RSS increase (MB)":>19}')
+        for case in args.cases:
+            result = run_benchmark(case, fnames, args.repeat)
+            result.update(shape=args.shape, dtype=args.dtype,
+                          n_runs=args.n_runs,
+                          compressed=not args.no_compress)
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(f'{case:<26}{result["time"]:>10.3f}'
+                      f'{result["peak_rss_mb"]:>15.1f}'
+                      f'{result["delta_rss_mb"]:>19.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+""" Make synthetic 4D images and data directories for benchmarks
+"""
+
+from pathlib import Path
+import hashlib
+
+import numpy as np
+
+import nibabel as nib
+
+
+def make_image(fname, shape=(64, 64, 30, 200), dtype=np.int16, seed=0):
+    """ Save synthetic 4D image of `shape` and `dtype` to `fname`
+
+    The image is a smooth "brain" of high values inside an ellipsoid, with
+    background near zero, plus noise, and a few volumes with added slice
+    artefacts.  Use a filename ending in ``.nii.gz`` for a compressed image.
+
+    Parameters
+    ----------
+    fname : str
+        Filename for image.
+    shape : sequence, optional
+        Shape of 4D image.
+    dtype : dtype, optional
+        Data type for image on disk.
+    seed : int, optional
+        Seed for random number generator.
+
+    Returns
+    -------
+    fname : Path
+    """
+    rng = np.random.default_rng(seed)
+    fname = Path(fname)
+    # Ellipsoid filling most of the field of view.
+    grids = np.meshgrid(*[np.linspace(-1, 1, n) for n in shape[:3]],
+                        indexing='ij')
+    in_brain = sum(grid ** 2 for grid in grids) < 0.8
+    mean_vol = np.where(in_brain, 1000, 20).astype(np.float32)
+    data = np.empty(shape, dtype=dtype)
+    for vol_no in range(shape[-1]):
+        vol = mean_vol + rng.normal(0, 10, size=shape[:3]).astype(np.float32)
+        if vol_no % 50 == 25:
+            vol[:, :, vol_no % shape[2]] += 300
+        data[..., vol_no] = vol
+    nib.save(nib.Nifti1Image(data, np.eye(4)), str(fname))
+    return fname
+
+
+def make_data_directory(data_directory, n_runs=4, **kwargs):
+    """ Make data directory with `n_runs` images and a hash list
+
+    Parameters
+    ----------
+    data_directory : str
+        Directory in which to make ``sub-*/func/*.nii.gz`` images and a
+        ``group-00/hash_list.txt`` file.
+    n_runs : int, optional
+        Number of images.
+    \\*\\*kwargs : dict
+        Other arguments to :func:`make_image`.
+
+    Returns
+    -------
+    fnames : list
+        Filenames of images.
+    """
+    data_directory = Path(data_directory)
+    fnames = []
+    lines = []
+    for run_no in range(n_runs):
+        rel_name = (f'sub-{run_no + 1:02d}/func/'
+                    f'sub-{run_no + 1:02d}_task-bench_run-01_bold.nii.gz')
+        fname = data_directory / rel_name
+        fname.parent.mkdir(parents=True, exist_ok=True)
+        make_image(fname, seed=run_no, **kwargs)
+        sha1 = hashlib.sha1(fname.read_bytes()).hexdigest()
+        lines.append(f'{sha1} {rel_name}')
+        fnames.append(fname)
+    (data_directory / 'group-00').mkdir(exist_ok=True)
+    (data_directory / 'group-00' / 'hash_list.txt').write_text(
+        '\n'.join(lines) + '\n')
+    return fnames
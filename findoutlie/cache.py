@@ -0,0 +1,152 @@
+""" On-disk cache of per-volume metrics for images
+
+Metrics for an image are stored in a ``.npz`` file named from the SHA1 hash of
+the image file and ``ALGORITHM_VERSION``.  Running the outlier detection again
+on an unchanged image, perhaps with a different detector, reads the cached
+metrics instead of reading the image.
+
+The cache has a maximum size.  Reading an entry marks it as recently used, and
+the least recently used entries are removed when the cache is too large.
+"""
+
+from pathlib import Path
+import os
+
+# Change this when changes to the metrics change their values, so we do not
+# use values cached from earlier versions.
+ALGORITHM_VERSION = 2
+
+DEFAULT_CACHE_DIR = Path('~/.cache/findoutlie').expanduser()
+
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+
+class MetricCache:
+    """ Cache of metric tables, keyed on SHA1 hash of image file
+
+    Parameters
+    ----------
+    directory : str, optional
+        Directory for cache files.  Default is ``DEFAULT_CACHE_DIR``.
+    max_bytes : int, optional
+        Maximum total size of cache files.  Default is ``DEFAULT_MAX_BYTES``.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = Path(DEFAULT_CACHE_DIR if directory is None
+                              else directory)
+        self.max_bytes = max_bytes
+
+    def path_for(self, sha1, variant=''):
+        """ Return path of cache file for image with hash `sha1`
+
+        `variant` names a variant of the metrics, for example ``'mask'`` for
+        metrics restricted to a brain mask.
+        """
+        suffix = f'-{variant}' if variant else ''
+        return self.directory / f'{sha1}-v{ALGORITHM_VERSION}{suffix}.npz'
+
+    def get(self, sha1, variant=''):
+        """ Return cached metric table for hash `sha1`, or None
+
+        Parameters
+        ----------
+        sha1 : str
+            SHA1 hash of image file.
+        variant : str, optional
+            Variant of metrics.  See :meth:`path_for`.
+
+        Returns
+        -------
+        table : dict or None
+            Dictionary with keys being metric names and values being 1D arrays
+            of metric values.  None if there is no cache entry for `sha1`.
+        """
+        # Import here, so listing and pruning the cache does not need numpy.
+        import numpy as np
+
+        path = self.path_for(sha1, variant)
+        try:
+            with np.load(path) as npz:
+                table = {name: npz[name] for name in npz.files}
+        except (OSError, ValueError):
+            return None
+        # Mark as recently used.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return table
+
+    def put(self, sha1, table, variant=''):
+        """ Store metric `table` for hash `sha1`, then prune the cache
+
+        Parameters
+        ----------
+        sha1 : str
+            SHA1 hash of image file.
+        table : dict
+            Dictionary with keys being metric names and values being 1D arrays
+            of metric values.
+        variant : str, optional
+            Variant of metrics.  See :meth:`path_for`.
+        """
+        import numpy as np
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path_for(sha1, variant)
+        # Write under a temporary name, so other processes never read a
+        # partly written file.
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as fobj:
+            np.savez(fobj, **table)
+        os.replace(tmp_path, path)
+        self.prune()
+
+    def entries(self):
+        """ Return list of ``(path, size, last_used)`` for cache files
+
+        The list is sorted from least to most recently used.
+        """
+        entries = []
+        for path in self.directory.glob('*.npz'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def size(self):
+        """ Return total size in bytes of cache files
+        """
+        return sum(size for path, size, last_used in self.entries())
+
+    def prune(self, max_bytes=None):
+        """ Remove least recently used files until cache fits in `max_bytes`
+
+        Parameters
+        ----------
+        max_bytes : int, optional
+            Maximum total size of cache files.  Default is ``self.max_bytes``.
+
+        Returns
+        -------
+        removed : list
+            Paths of removed files.
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = self.entries()
+        total = sum(size for path, size, last_used in entries)
+        removed = []
+        for path, size, last_used in entries:
+            if total <= max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed.append(path)
+        return removed
@@ -10,14 +10,13 @@ other on normally distributed values etc.  The routines should check that their
 requirements are met and raise an error otherwise.
 """
 
-# Any imports you need
-# +++your code here+++
+import numpy as np
 
 
-def iqr_detector(measures, iqr_proportion=1.5):
+def iqr_detector(measures, iqr_proportion=1.5, axis=-1):
     """ Detect outliers in `measures` using interquartile range.
 
-    Returns a boolean vector of same length as `measures`, where True means the
+    Returns a boolean array of same shape as `measures`, where True means the
     corresponding value in `measures` is an outlier.
 
     Call Q1, Q2 and Q3 the 25th, 50th and 75th percentiles of `measures`.
@@ -31,23 +30,104 @@ def iqr_detector(measures, iqr_proportion=1.5):
 
     See: https://en.wikipedia.org/wiki/Interquartile_range
 
+    For a 2D `measures`, the percentiles are calculated separately for each
+    row or column (see `axis`), all in one call.  NaN values are ignored when
+    calculating the percentiles, and are never outliers.
+
     Parameters
     ----------
-    measures : 1D array
+    measures : 1D or 2D array
         Values for which we will detect outliers
     iqr_proportion : float, optional
         Scalar to multiply the IQR to form upper and lower threshold (see
         above).  Default is 1.5.
+    axis : int, optional
+        Axis along which to calculate the percentiles.  For example, for a
+        runs by time array, ``axis=-1`` (the default) finds outlier time
+        points within each run, and for a runs by metrics array, ``axis=0``
+        finds outlier runs for each metric.
+
+    Returns
+    -------
+    outlier_tf : boolean array
+        A boolean array of same shape as `measures`, where True means the
+        corresponding value in `measures` is an outlier.
+    """
+    measures = np.asarray(measures)
+    percentile = (np.nanpercentile if np.isnan(measures).any()
+                  else np.percentile)
+    q1, q3 = percentile(measures, [25, 75], axis=axis, keepdims=True)
+    iqr = q3 - q1
+    up_thresh = q3 + iqr * iqr_proportion
+    down_thresh = q1 - iqr * iqr_proportion
+    return np.logical_or(measures > up_thresh, measures < down_thresh)
+
+
+def mean_std_detector(measures, n_std=2, axis=-1):
+    """ Detect values in `measures` more than `n_std` SDs above the mean
+
+    An outlier is any value in `measures` that is > mean + SD * `n_std`,
+    where mean and SD are the mean and standard deviation of `measures`.
+
+    Parameters
+    ----------
+    measures : 1D or 2D array
+        Values for which we will detect outliers
+    n_std : float, optional
+        Number of standard deviations above the mean for the threshold.
+        Default is 2.
+    axis : int, optional
+        Axis along which to calculate mean and standard deviation.  See
+        :func:`iqr_detector`.
+
+    Returns
+    -------
+    outlier_tf : boolean array
+        A boolean array of same shape as `measures`, where True means the
+        corresponding value in `measures` is an outlier.
+    """
+    measures = np.asarray(measures)
+    mean = np.nanmean(measures, axis=axis, keepdims=True)
+    std = np.nanstd(measures, axis=axis, keepdims=True)
+    return measures > mean + n_std * std
+
+
+def mad_detector(measures, threshold=3.5, axis=-1):
+    """ Detect outliers in `measures` using median absolute deviation (MAD)
+
+    Call M the median of `measures`, and MAD the median of the absolute
+    differences between `measures` and M.  An outlier is any value in
+    `measures` with a modified z-score ``0.6745 * (value - M) / MAD`` greater
+    than `threshold` in absolute value.
+
+    See: Iglewicz and Hoaglin (1993) "How to Detect and Handle Outliers".
+
+    Parameters
+    ----------
+    measures : 1D or 2D array
+        Values for which we will detect outliers
+    threshold : float, optional
+        Threshold for absolute modified z-score.  Default is 3.5.
+    axis : int, optional
+        Axis along which to calculate medians.  See :func:`iqr_detector`.
 
     Returns
     -------
-    outlier_tf : 1D boolean array
-        A boolean vector of same length as `measures`, where True means the
+    outlier_tf : boolean array
+        A boolean array of same shape as `measures`, where True means the
         corresponding value in `measures` is an outlier.
     """
-    # Any imports you need
-    # Hints:
-    # * investigate np.percentile
-    # * You'll likely need np.logical_or
-    # https://textbook.nipraxis.org/numpy_logical.html
-    # +++your code here+++
+    measures = np.asarray(measures)
+    median = np.nanmedian(measures, axis=axis, keepdims=True)
+    abs_devs = np.abs(measures - median)
+    mad = np.nanmedian(abs_devs, axis=axis, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 0.6745 * abs_devs / mad > threshold
+
+
+# Detector name: detector function.
+DETECTORS = {
+    'mean_std': mean_std_detector,
+    'iqr': iqr_detector,
+    'mad': mad_detector,
+}
@@ -0,0 +1,156 @@
+""" Calculate several metrics from one read of a 4D image
+
+Decompressing ``.nii.gz`` files is often slower than calculating the metrics,
+so we read each block of volumes once, and pass it to an accumulator for each
+metric.
+
+An accumulator is an object with an ``update(block)`` method, called with
+each 4D block of volumes in turn, and a ``result()`` method returning a 1D
+array with one value per volume.  Add new metrics by adding a function
+returning a new accumulator to ``METRICS``.  The function takes a ``mask``
+keyword argument, a 3D boolean brain mask or None.
+
+With a mask, taking the voxels in the mask from each block is a large part of
+the work, so we do it once per block, rather than once per accumulator.
+Accumulators with an ``update_voxels(vox_by_vol)`` method get a 2D (voxels,
+volumes) array of the voxels in the mask, and those with an
+``update_planes(plane_data)`` method get a 3D (positions, slices, volumes)
+array of the in-plane positions in the mask (see
+:func:`findoutlie.masks.slice_mask`).  Other accumulators get the whole block.
+
+Slice metrics, in ``SLICE_METRICS``, have a value for each slice of each
+volume, so their accumulators return 2D arrays of shape (n_slices,
+n_volumes).  Ask for them by name; they are not calculated by default.
+"""
+
+from functools import partial
+
+import numpy as np
+
+from . import profiling
+from .metrics import (PCA_METHODS, DvarsAccumulator, PcaVarianceAccumulator,
+                      SliceDvarsAccumulator, SliceMeanAccumulator)
+from .spm_funcs import SpmGlobalAccumulator
+from .masks import masked_voxels, mean_mask, slice_mask
+from .volumes import iter_volume_blocks, open_image
+
+# Metric name: function returning new accumulator for metric.
+METRICS = {
+    'dvars': partial(DvarsAccumulator, pad_first=True),
+    'spm_global': SpmGlobalAccumulator,
+    'pca_variance': PcaVarianceAccumulator,
+}
+
+# Slice metric name: function returning new accumulator for metric.
+SLICE_METRICS = {
+    'slice_dvars': partial(SliceDvarsAccumulator, pad_first=True),
+    'slice_mean': SliceMeanAccumulator,
+}
+
+
+def compute_metrics(img, metrics=None, memory_budget=None, mask=None,
+                    prefetch=0, pca_method='eigh'):
+    """ Calculate `metrics` for each volume in 4D image `img`
+
+    Parameters
+    ----------
+    img : str or nibabel image
+        Filename of 4D image, or 4D nibabel image.
+    metrics : sequence of str, optional
+        Names of metrics to calculate, from ``METRICS`` or ``SLICE_METRICS``.
+        Default is all the metrics in ``METRICS``.
+    memory_budget : int, optional
+        Maximum size in bytes of each block of volumes read from `img`.  See
+        :func:`findoutlie.volumes.iter_volume_blocks`.
+    mask : 3D boolean array or 'auto', optional
+        If given, restrict metrics to voxels in this brain mask.  'auto' makes
+        a mask from the mean of the first block of volumes, with
+        :func:`findoutlie.masks.mean_mask`, so there is no extra read of
+        `img`.
+    prefetch : int, optional
+        Number of blocks to read ahead in a background thread, while
+        calculating the metrics for the current block.  See
+        :func:`findoutlie.volumes.iter_volume_blocks`.
+    pca_method : {'eigh', 'power'}, optional
+        Method for the largest eigenvalue in the PCA variance metric.  See
+        :func:`findoutlie.metrics.pca_variance`.
+
+    Returns
+    -------
+    table : dict
+        Dictionary with keys being metric names and values being 1D arrays
+        with one value per volume, or, for slice metrics, 2D arrays of shape
+        (n_slices, n_volumes).  dvars and slice_dvars have NaN for the first
+        volume.
+    """
+    if metrics is None:
+        metrics = list(METRICS)
+    all_metrics = {**METRICS, **SLICE_METRICS}
+    unknown = set(metrics).difference(all_metrics)
+    if unknown:
+        raise ValueError(f'Unknown metrics: {", ".join(sorted(unknown))}')
+    if pca_method not in PCA_METHODS:
+        raise ValueError(f'Unknown PCA method {pca_method}')
+    img = open_image(img)
+    auto_mask = isinstance(mask, str) and mask == 'auto'
+    # slice_dvars has the squared differences for dvars, summed over slices,
+    # so derive dvars from those, rather than calculating them again.
+    shared_dvars = 'dvars' in metrics and 'slice_dvars' in metrics
+    names = [name for name in metrics
+             if not (shared_dvars and name == 'dvars')]
+
+    def make_accumulator(name, mask):
+        if name == 'pca_variance':
+            return all_metrics[name](mask=mask, method=pca_method)
+        return all_metrics[name](mask=mask)
+
+    accumulators = None
+    for block in iter_volume_blocks(img, memory_budget=memory_budget,
+                                    dtype=np.float64, prefetch=prefetch):
+        if accumulators is None:
+            if auto_mask:
+                with profiling.stage('mask'):
+                    mask = mean_mask(np.mean(block, axis=-1))
+            accumulators = {name: make_accumulator(name, mask)
+                            for name in names}
+        _update_accumulators(accumulators, block, mask)
+    if accumulators is None:  # Image with no volumes.
+        accumulators = {name: make_accumulator(name, None) for name in names}
+    table = {name: accumulator.result()
+             for name, accumulator in accumulators.items()}
+    if shared_dvars:
+        table['dvars'] = accumulators['slice_dvars'].volume_result()
+    return {name: table[name] for name in metrics}
+
+
+def _update_accumulators(accumulators, block, mask=None):
+    """ Pass `block` to `accumulators`, taking voxels in `mask` only once
+    """
+    if mask is None:
+        for name, accumulator in accumulators.items():
+            with profiling.stage(f'metric:{name}'):
+                accumulator.update(block)
+        return
+    want_voxels = any(hasattr(accumulator, 'update_voxels')
+                      for accumulator in accumulators.values())
+    want_planes = any(hasattr(accumulator, 'update_planes')
+                      for accumulator in accumulators.values())
+    plane_data = vox_by_vol = None
+    with profiling.stage('mask'):
+        if want_planes:
+            plane_mask = slice_mask(mask)
+            plane_data = masked_voxels(block, plane_mask)
+            if want_voxels:
+                # Voxels in the mask are a subset of the in-plane positions,
+                # so take them from the smaller array.
+                vox_by_vol = masked_voxels(plane_data, mask[plane_mask])
+        elif want_voxels:
+            vox_by_vol = masked_voxels(block, mask)
+    for name, accumulator in accumulators.items():
+        with profiling.stage(f'metric:{name}'):
+            if hasattr(accumulator, 'update_voxels'):
+                accumulator.update_voxels(vox_by_vol)
+            elif hasattr(accumulator, 'update_planes'):
+                accumulator.update_planes(plane_data)
+            else:
+                accumulator.update(block)
@@ -0,0 +1,139 @@
+""" Detect outlier runs and subjects by comparing runs across a dataset
+
+:func:`~findoutlie.outfind.detect_outliers` compares volumes within one run,
+so it cannot find a run that is bad compared to the other runs.  Here we
+summarize the per-volume metrics for each run in a metric store (see
+:mod:`findoutlie.store`), with the mean and maximum of each metric, and then
+look for runs, and subjects, with outlying summaries.
+
+The summaries come from the stored metrics, without reading any images, and
+are calculated for all runs at once, so this scales to many thousands of runs.
+"""
+
+import re
+
+import numpy as np
+
+from .detectors import iqr_detector
+
+SUBJECT_RE = re.compile(r'(sub-[^_/\\]+)')
+
+
+def run_summaries(store):
+    """ Summarize metrics in `store` for each run
+
+    Parameters
+    ----------
+    store : MetricStore
+        Store of per-volume metrics.  All runs should have at least one
+        volume.
+
+    Returns
+    -------
+    names : list
+        Names of summaries, of form ``<metric>_<summary>``, e.g.
+        ``dvars_mean``.
+    summaries : 2D array
+        Array of shape (n_runs, n_summaries), with values of each summary for
+        each run, in the order of ``store.runs``.  NaN values, such as the
+        DVARS value for the first volume, are ignored.
+    """
+    starts = store.offsets()[:-1]
+    if len(starts) == 0:
+        return [], np.zeros((0, 0))
+    names, columns = [], []
+    for metric in store.metrics:
+        values = np.asarray(store.column(metric))
+        is_valid = ~np.isnan(values)
+        # Mean and maximum of non-NaN values for each run, with one pass over
+        # the values for all runs.
+        sums = np.add.reduceat(np.where(is_valid, values, 0), starts)
+        counts = np.add.reduceat(is_valid.astype(int), starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+        names += [f'{metric}_mean', f'{metric}_max']
+        columns += [means, np.fmax.reduceat(values, starts)]
+    return names, np.stack(columns, axis=1)
+
+
+def subject_of(fname):
+    """ Return subject label, e.g. ``sub-01``, for filename `fname`, or None
+    """
+    match = SUBJECT_RE.search(str(fname))
+    return None if match is None else match.group(1)
+
+
+def subject_summaries(fnames, summaries):
+    """ Average run `summaries` for each subject
+
+    Parameters
+    ----------
+    fnames : sequence of str
+        Filename for each run.
+    summaries : 2D array
+        Array of shape (n_runs, n_summaries).  See :func:`run_summaries`.
+
+    Returns
+    -------
+    subjects : list
+        Sorted subject labels.  Runs without a subject label in their
+        filename are left out.
+    sub_summaries : 2D array
+        Array of shape (n_subjects, n_summaries), with the mean of the
+        summaries for the runs of each subject.
+    """
+    labels = [subject_of(fname) for fname in fnames]
+    has_label = np.array([label is not None for label in labels], dtype=bool)
+    summaries = np.asarray(summaries)[has_label]
+    subjects, indices = np.unique(
+        [label for label in labels if label is not None], return_inverse=True)
+    indices = np.reshape(indices, -1)
+    counts = np.bincount(indices, minlength=len(subjects))
+    sub_summaries = np.zeros((len(subjects), summaries.shape[1]))
+    np.add.at(sub_summaries, indices, summaries)
+    return list(subjects), sub_summaries / counts[:, None]
+
+
+def _flagged(labels, names, outlier_tf):
+    """ Return dict of label: names of outlier summaries, for flagged labels
+    """
+    return {label: [name for name, is_out in zip(names, row) if is_out]
+            for label, row in zip(labels, outlier_tf) if np.any(row)}
+
+
+def group_outliers(store, detector=iqr_detector):
+    """ Find runs and subjects with outlying metric summaries in `store`
+
+    Parameters
+    ----------
+    store : MetricStore
+        Store of per-volume metrics for many runs.
+    detector : callable, optional
+        Function taking a 2D array and an `axis` keyword argument, returning a
+        boolean array of the same shape, where True means the value is an
+        outlier compared to the other values along `axis`.  See
+        :mod:`findoutlie.detectors`.  The default uses the interquartile
+        range.
+
+    Returns
+    -------
+    run_outliers : dict
+        Dictionary with keys being filenames of outlier runs and values being
+        lists of names of outlying summaries for that run.  See
+        :func:`run_summaries`.
+    subject_outliers : dict
+        Dictionary with keys being labels of outlier subjects and values being
+        lists of names of outlying summaries, averaged over the runs of that
+        subject.
+    """
+    names, summaries = run_summaries(store)
+    if len(names) == 0:
+        return {}, {}
+    fnames = [run['fname'] for run in store.runs]
+    run_outliers = _flagged(fnames, names, detector(summaries, axis=0))
+    subjects, sub_summaries = subject_summaries(fnames, summaries)
+    subject_outliers = {}
+    if len(subjects):
+        subject_outliers = _flagged(subjects, names,
+                                    detector(sub_summaries, axis=0))
+    return run_outliers, subject_outliers
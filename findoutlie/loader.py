@@ -0,0 +1,181 @@
+""" Load images, with faster gzip decompression where available
+
+Decompressing ``.nii.gz`` files is often the slowest part of finding outliers.
+:func:`load_image` reads ``.nii.gz`` files with the fastest available gzip
+module:
+
+* ``indexed_gzip``, used by nibabel itself, if installed;
+* ``isal.igzip``, from ``python-isal``;
+* ``zlib_ng.gzip_ng``, from ``zlib-ng``;
+* the standard library ``gzip`` module.
+
+None of these modules is required.
+
+With a scratch directory, :func:`load_image` decompresses each ``.nii.gz``
+file once to a ``.nii`` file in the scratch directory, and loads that file with
+memory mapping, so later passes over the same image need no decompression.
+Set the scratch directory with the `scratch_dir` argument, or with the
+``FINDOUTLIE_SCRATCH_DIR`` environment variable, which also applies in worker
+processes.  Nothing removes files from the scratch directory; that is up to
+you.
+"""
+
+from pathlib import Path
+import gzip
+import hashlib
+import importlib.util
+import os
+import shutil
+import weakref
+
+import nibabel as nib
+from nibabel.filebasedimages import FileHolder
+
+from . import profiling
+
+try:
+    from isal import igzip as fast_gzip
+    GZIP_BACKEND = 'isal'
+except ImportError:
+    try:
+        from zlib_ng import gzip_ng as fast_gzip
+        GZIP_BACKEND = 'zlib-ng'
+    except ImportError:
+        fast_gzip = None
+        GZIP_BACKEND = 'gzip'
+
+# nibabel uses indexed_gzip, if installed, for random access to gzip files.
+HAVE_INDEXED_GZIP = importlib.util.find_spec('indexed_gzip') is not None
+if HAVE_INDEXED_GZIP:
+    GZIP_BACKEND = 'indexed_gzip'
+
+SCRATCH_ENV_VAR = 'FINDOUTLIE_SCRATCH_DIR'
+
+# Size in bytes of NIfTI2 header, to tell NIfTI2 from NIfTI1 files.
+NIFTI2_HEADER_SIZE = 540
+
+# Images returned by load_image.
+_LOADED = weakref.WeakSet()
+
+
+def gzip_open(fname):
+    """ Open gzip file `fname` for reading with fastest available module
+    """
+    if fast_gzip is None:
+        return gzip.open(fname, 'rb')
+    return fast_gzip.open(fname, 'rb')
+
+
+class _ReopeningGzipFile:
+    """ Read-only gzip file that reopens itself to seek backwards
+
+    The readers in ``isal.igzip`` and ``zlib_ng.gzip_ng`` can fail to seek
+    backwards after reading; we start again from a new file instead.  All
+    other attributes come from the wrapped file.
+    """
+
+    def __init__(self, fname):
+        self._fname = fname
+        self._fobj = fast_gzip.open(fname, 'rb')
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset, whence = self._fobj.tell() + offset, 0
+        if whence == 0 and offset < self._fobj.tell():
+            self._fobj.close()
+            self._fobj = fast_gzip.open(self._fname, 'rb')
+        return self._fobj.seek(offset, whence)
+
+    def __getattr__(self, name):
+        return getattr(self._fobj, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._fobj.close()
+
+
+def _scratch_fname(fname, scratch_dir):
+    """ Return name of decompressed copy of `fname` in `scratch_dir`
+
+    The name depends on the path, size and modification time of `fname`, so a
+    changed file gets a new copy.
+    """
+    stat = os.stat(fname)
+    key = f'{Path(fname).resolve()}:{stat.st_size}:{stat.st_mtime_ns}'
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    return Path(scratch_dir) / f'{digest}.nii'
+
+
+def decompress_to(fname, out_fname):
+    """ Decompress gzip file `fname` to `out_fname`
+
+    Decompress to a temporary file and then move to `out_fname`, so other
+    processes never see a partial file.
+    """
+    out_fname = Path(out_fname)
+    out_fname.parent.mkdir(parents=True, exist_ok=True)
+    tmp_fname = out_fname.with_name(f'{out_fname.name}.{os.getpid()}.tmp')
+    with profiling.stage('decompress', os.path.getsize(fname)):
+        with gzip_open(fname) as in_file, open(tmp_fname, 'wb') as out_file:
+            shutil.copyfileobj(in_file, out_file, 1024 ** 2)
+    os.replace(tmp_fname, out_fname)
+    return out_fname
+
+
+def load_image(fname, scratch_dir=None):
+    """ Load image `fname`, for reading data in blocks
+
+    Parameters
+    ----------
+    fname : str
+        Filename of image.
+    scratch_dir : str, optional
+        Directory for decompressed copies of ``.nii.gz`` files.  Default is
+        the value of the ``FINDOUTLIE_SCRATCH_DIR`` environment variable, if
+        set.  If there is no scratch directory, decompress ``.nii.gz`` files
+        as the data is read.
+
+    Returns
+    -------
+    img : nibabel image
+        Image that keeps its file open, so reading successive blocks of
+        volumes is one pass through the file.
+    """
+    fname = str(fname)
+    if scratch_dir is None:
+        scratch_dir = os.environ.get(SCRATCH_ENV_VAR)
+    with profiling.stage('load', os.path.getsize(fname)):
+        img = _load_image(fname, scratch_dir)
+    _LOADED.add(img)
+    return img
+
+
+def is_loaded(img):
+    """ Return True if `img` came from :func:`load_image`
+    """
+    return img in _LOADED
+
+
+def _load_image(fname, scratch_dir):
+    """ Load image `fname`, using `scratch_dir` if not empty
+    """
+    if not fname.endswith('.gz'):
+        return nib.load(fname, keep_file_open=True)
+    if scratch_dir:
+        nii_fname = _scratch_fname(fname, scratch_dir)
+        if not nii_fname.exists():
+            decompress_to(fname, nii_fname)
+        return nib.load(nii_fname, mmap=True)
+    if fast_gzip is None or HAVE_INDEXED_GZIP:
+        return nib.load(fname, keep_file_open=True)
+    fobj = _ReopeningGzipFile(fname)
+    # First header field is header size, in either byte order.
+    sizeof_hdr = fobj.read(4)
+    fobj.seek(0)
+    is_nifti2 = NIFTI2_HEADER_SIZE in (int.from_bytes(sizeof_hdr, 'little'),
+                                       int.from_bytes(sizeof_hdr, 'big'))
+    klass = nib.Nifti2Image if is_nifti2 else nib.Nifti1Image
+    holder = FileHolder(filename=fname, fileobj=fobj)
+    return klass.from_file_map({'header': holder, 'image': holder})
@@ -0,0 +1,139 @@
+""" Brain masks for restricting metrics to voxels in the brain
+
+In a typical EPI image, most voxels in the field of view are background.
+Calculating metrics only for voxels in a brain mask is faster, and the
+metrics are not diluted by background noise.
+"""
+
+import numpy as np
+
+from .volumes import iter_volume_blocks
+
+
+def mean_image(img, memory_budget=None, prefetch=0):
+    """ Return mean over volumes of 4D image `img`
+
+    Parameters
+    ----------
+    img : str or nibabel image
+        Filename of 4D image, or 4D nibabel image.
+    memory_budget : int, optional
+        Maximum size in bytes of each block of volumes read from `img`.  See
+        :func:`findoutlie.volumes.iter_volume_blocks`.
+    prefetch : int, optional
+        Number of blocks to read ahead.  See
+        :func:`findoutlie.volumes.iter_volume_blocks`.
+
+    Returns
+    -------
+    mean_vol : 3D array
+        Mean of all volumes.
+    """
+    total = None
+    n_vols = 0
+    for block in iter_volume_blocks(img, memory_budget=memory_budget,
+                                    dtype=np.float64, prefetch=prefetch):
+        block_sum = np.sum(block, axis=-1)
+        total = block_sum if total is None else total + block_sum
+        n_vols += block.shape[-1]
+    return total / n_vols
+
+
+def compute_mask(img, memory_budget=None, prefetch=0):
+    """ Return brain mask for 4D image `img`
+
+    The mask is all voxels where the mean over volumes is greater than the
+    mean of the mean volume divided by 8, as for the SPM global metric.  See
+    :func:`findoutlie.spm_funcs.spm_global`.
+
+    Parameters
+    ----------
+    img : str or nibabel image
+        Filename of 4D image, or 4D nibabel image.
+    memory_budget : int, optional
+        Maximum size in bytes of each block of volumes read from `img`.  See
+        :func:`findoutlie.volumes.iter_volume_blocks`.
+    prefetch : int, optional
+        Number of blocks to read ahead.  See
+        :func:`findoutlie.volumes.iter_volume_blocks`.
+
+    Returns
+    -------
+    mask : 3D boolean array
+        True for voxels in the brain.
+    """
+    mean_vol = mean_image(img, memory_budget=memory_budget, prefetch=prefetch)
+    return mean_mask(mean_vol)
+
+
+def mean_mask(mean_vol):
+    """ Return brain mask from mean volume `mean_vol`
+
+    See :func:`compute_mask`.
+
+    Parameters
+    ----------
+    mean_vol : 3D array
+        Mean over some or all volumes of a 4D image.
+
+    Returns
+    -------
+    mask : 3D boolean array
+        True for voxels in the brain.
+    """
+    return mean_vol > np.mean(mean_vol) / 8
+
+
+def masked_voxels(data, mask):
+    """ Return values of `data` where `mask` is True, as for ``data[mask]``
+
+    Boolean indexing is slow for the Fortran-ordered blocks from
+    :func:`findoutlie.volumes.iter_volume_blocks`, where each voxel is far
+    from the next in memory.  Here we take the voxels from each contiguous
+    volume in turn, and return a Fortran-ordered array.
+
+    Parameters
+    ----------
+    data : array
+        Array with the shape of `mask` for its first axes, and volumes on the
+        remaining axes.
+    mask : boolean array
+        Mask over the first axes of `data`.
+
+    Returns
+    -------
+    masked : array
+        Array of shape ``(n_true,) + data.shape[mask.ndim:]``, with the same
+        values, in the same order, as ``data[mask]``.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    rest = data.shape[mask.ndim:]
+    order = 'F' if np.isfortran(data) else 'C'
+    # View of data with a row for each position in `mask`, for contiguous
+    # arrays.
+    by_position = np.reshape(data, (mask.size, -1), order=order)
+    indices = np.ravel_multi_index(np.nonzero(mask), mask.shape, order=order)
+    if order == 'F':
+        masked = by_position.T.take(indices, axis=1).T
+    else:
+        masked = by_position.take(indices, axis=0)
+    return np.reshape(masked, (len(indices),) + rest, order=order)
+
+
+def slice_mask(mask):
+    """ Return 2D mask of in-plane positions in `mask` in any slice
+
+    Metrics on slices, such as :func:`findoutlie.metrics.pca_variance`, need
+    the same voxels from each slice.
+
+    Parameters
+    ----------
+    mask : 3D boolean array
+        Brain mask, with slices on the last axis.
+
+    Returns
+    -------
+    plane_mask : 2D boolean array
+        True for positions in the plane that are in `mask` in any slice.
+    """
+    return np.any(mask, axis=-1)
@@ -1,13 +1,17 @@
 """ Scan outlier metrics
 """
 
-# Any imports you need
-# +++your code here+++
 import numpy as np
-import nibabel as nib
 
+from . import profiling
+from .masks import masked_voxels, slice_mask
+from .volumes import iter_volume_blocks
 
-def dvars(img):
+# Methods for the largest eigenvalue in pca_variance.
+PCA_METHODS = ('eigh', 'power')
+
+
+def dvars(img, memory_budget=None, dtype=np.float64, mask=None):
     """ Calculate dvars metric on Nibabel image `img`
 
     The dvars calculation between two volumes is defined as the square root of
@@ -15,7 +19,16 @@ def dvars(img):
 
     Parameters
     ----------
-    img : nibabel image
+    img : nibabel image or str
+        4D image, or filename of 4D image.
+    memory_budget : int, optional
+        Maximum size in bytes of each block of volumes read from `img`.  See
+        :func:`findoutlie.volumes.iter_volume_blocks`.
+    dtype : dtype, optional
+        Data type for reading and calculation.  ``np.float32`` halves memory
+        use, at some cost in precision.
+    mask : 3D boolean array, optional
+        If given, only use voxels where `mask` is True.
 
     Returns
     -------
@@ -23,16 +36,338 @@ def dvars(img):
         One-dimensional array with n-1 elements, where n is the number of
         volumes in `img`.
     """
-    # Hint: remember 'axis='.  For example:
-    # In [2]: arr = np.array([[2, 3, 4], [5, 6, 7]])
-    # In [3]: np.mean(arr, axis=1)
-    # Out[2]: array([3., 6.])
+    accumulator = DvarsAccumulator(mask=mask)
+    for block in iter_volume_blocks(img, memory_budget=memory_budget,
+                                    dtype=dtype):
+        with profiling.stage('metric:dvars'):
+            accumulator.update(block)
+    return accumulator.result()
+
+
+class DvarsAccumulator:
+    """ Calculate dvars from blocks of consecutive volumes
+
+    Only the last volume of the previous block is kept between blocks.  Within
+    a block, we make one array of volume differences, and square it in place,
+    rather than making another copy.
+
+    Parameters
+    ----------
+    pad_first : bool, optional
+        If True, the result starts with NaN for the first volume, so there is
+        one value per volume.  Default is False, giving n-1 values for n
+        volumes.
+    mask : 3D boolean array, optional
+        If given, only use voxels where `mask` is True.
+    """
+
+    def __init__(self, pad_first=False, mask=None):
+        self._dvals = [[np.nan]] if pad_first else []
+        self._prev_vol = None
+        self._mask = None if mask is None else np.asarray(mask, dtype=bool)
+
+    def update(self, block):
+        """ Add 4D `block` of volumes, following volumes already added
+        """
+        if self._mask is None:
+            # Voxel order does not matter, so reshape without copying.
+            block = np.reshape(block, (-1, block.shape[-1]), order='A')
+        else:
+            block = masked_voxels(block, self._mask)
+        self.update_voxels(block)
+
+    def update_voxels(self, block):
+        """ Add 2D (voxels, volumes) `block`, with only the voxels in the mask
+        """
+        if self._prev_vol is not None:
+            # Difference between last volume of previous block and first
+            # volume of this one.
+            first_diff = block[:, 0] - self._prev_vol
+            self._dvals.append([np.dot(first_diff, first_diff)
+                                / len(first_diff)])
+        # Fortran order makes each volume contiguous, so the sum below uses
+        # pairwise summation, keeping float32 precision.
+        vol_diff = np.subtract(block[:, 1:], block[:, :-1], order='F')
+        np.square(vol_diff, out=vol_diff)
+        self._dvals.append(np.sum(vol_diff, axis=0) / len(block))
+        self._prev_vol = block[:, -1].copy()
+
+    def result(self):
+        """ Return 1D array of dvars values for volumes added so far
+        """
+        return np.sqrt(np.concatenate(self._dvals + [[]]))
+
+    def pop_values(self):
+        """ Return dvars values since the last call, and forget them
+
+        The last volume is still kept, so the next block gives the dvars value
+        between the blocks.  Use this to get values as volumes arrive, without
+        keeping all the values.
+        """
+        values = self.result()
+        self._dvals = []
+        return values
+
+
+def leading_eigenvalues(matrices, tol=1e-10, max_iter=100, seed=0):
+    """ Largest eigenvalue of each symmetric positive semi-definite matrix
+
+    Use power iteration on all matrices together, stopping for each matrix
+    when the relative change in the estimate of its eigenvalue is less than
+    `tol`.  Power iteration converges quickly when the largest eigenvalue is
+    much larger than the others, as for volumes with a strong first PCA
+    component.  Matrices that have not converged after `max_iter` iterations
+    get their eigenvalue from ``np.linalg.eigvalsh``.
+
+    Parameters
+    ----------
+    matrices : 3D array
+        Array of shape (n, m, m) of n symmetric positive semi-definite
+        matrices.
+    tol : float, optional
+        Relative tolerance for convergence.
+    max_iter : int, optional
+        Maximum number of iterations before using ``np.linalg.eigvalsh``.
+    seed : int, optional
+        Seed for the random starting vectors, so results are reproducible.
+
+    Returns
+    -------
+    eigvals : 1D array
+        Largest eigenvalue of each matrix.
+    """
+    matrices = np.asarray(matrices, dtype=np.float64)
+    n, m = matrices.shape[:2]
+    vecs = np.random.default_rng(seed).standard_normal((n, m))
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    eigvals = np.zeros(n)
+    active = np.arange(n)
+    for i in range(max_iter):
+        prods = np.einsum('vij,vj->vi', matrices[active], vecs[active])
+        # Rayleigh quotient for unit vectors.
+        estimates = np.einsum('vi,vi->v', vecs[active], prods)
+        norms = np.linalg.norm(prods, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        vecs[active] = prods / norms
+        done = np.abs(estimates - eigvals[active]) <= tol * np.abs(estimates)
+        eigvals[active] = estimates
+        active = active[~done]
+        if active.size == 0:
+            return eigvals
+    eigvals[active] = np.linalg.eigvalsh(matrices[active])[:, -1]
+    return eigvals
+
+
+def pca_variance(data, mask=None, method='eigh', tol=1e-10, seed=0):
+    """ Proportion of variance explained by first PCA component per volume
+
+    For each 3D volume, treat the voxels in each slice as observations, and the
+    slices as variables.  Find the proportion of the total variance explained
+    by the first principal component of these observations.
+
+    All volumes are done together, from the (slices by slices) covariance
+    matrix of each volume.  The total variance is the trace of the covariance
+    matrix, and the variance of the first component is its largest
+    eigenvalue.
+
+    Parameters
+    ----------
+    data : 4D array
+        Image data, with slices on the third axis and volumes on the last.
+        Can also be a 3D array of shape (positions, slices, volumes).
+    mask : 3D boolean array, optional
+        If given, only use in-plane positions that are in `mask` in any slice.
+        See :func:`findoutlie.masks.slice_mask`.
+    method : {'eigh', 'power'}, optional
+        Method for the largest eigenvalue; 'eigh' finds all eigenvalues with
+        ``np.linalg.eigvalsh``, 'power' uses :func:`leading_eigenvalues`.
+    tol : float, optional
+        Relative tolerance for 'power' method.
+    seed : int, optional
+        Random seed for 'power' method.
+
+    Returns
+    -------
+    pca_vals : 1D array
+        One-dimensional array with n elements, where n is the number of volumes
+        in `data`.
+    """
+    if method not in PCA_METHODS:
+        raise ValueError(f'Unknown method {method}')
+    n_vols = data.shape[-1]
+    n_slices = data.shape[-2]
+    # Voxels in slice by slices by volumes.
+    if mask is None:
+        slice_data = np.reshape(data, (-1, n_slices, n_vols), order='A')
+    else:
+        slice_data = masked_voxels(data, slice_mask(mask))
+    centered = slice_data - np.mean(slice_data, axis=0)
+    # Covariance (up to scaling) of slices for each volume, as a batched
+    # matrix product.  For the usual Fortran-ordered blocks, the transpose is
+    # already C-contiguous.
+    by_vol = np.ascontiguousarray(centered.T)
+    covs = by_vol @ np.swapaxes(by_vol, 1, 2)
+    if method == 'power':
+        max_eigvals = leading_eigenvalues(covs, tol=tol, seed=seed)
+    else:
+        # eigvalsh returns eigenvalues in ascending order.
+        max_eigvals = np.linalg.eigvalsh(covs)[:, -1]
+    return max_eigvals / np.trace(covs, axis1=1, axis2=2)
+
+
+class PcaVarianceAccumulator:
+    """ Calculate PCA variance from blocks of volumes
+
+    See :func:`pca_variance`.
+
+    Parameters
+    ----------
+    mask : 3D boolean array, optional
+        Brain mask.  See :func:`pca_variance`.
+    method : {'eigh', 'power'}, optional
+        Method for largest eigenvalue.  See :func:`pca_variance`.
+    tol : float, optional
+        Relative tolerance for 'power' method.  See :func:`pca_variance`.
+    seed : int, optional
+        Random seed for 'power' method.  See :func:`pca_variance`.
+    """
+
+    def __init__(self, mask=None, method='eigh', tol=1e-10, seed=0):
+        self._pca_vals = []
+        self._mask = mask
+        self._options = dict(method=method, tol=tol, seed=seed)
+
+    def update(self, block):
+        """ Add 4D `block` of volumes, following volumes already added
+        """
+        self._pca_vals.append(pca_variance(block, self._mask,
+                                           **self._options))
+
+    def update_planes(self, plane_data):
+        """ Add 3D (positions, slices, volumes) array `plane_data`
+
+        `plane_data` has only the in-plane positions in the mask, as from
+        :func:`findoutlie.masks.masked_voxels` with
+        :func:`findoutlie.masks.slice_mask`.
+        """
+        self._pca_vals.append(pca_variance(plane_data, **self._options))
+
+    def result(self):
+        """ Return 1D array of PCA variance for volumes added so far
+        """
+        return np.concatenate(self._pca_vals + [[]])
+
+
+def _slice_sums(arr, weights=None):
+    """ Sum 4D `arr` over the in-plane axes, giving (slices, volumes) array
+
+    If given, `weights` is a 3D array multiplying each volume before summing.
+    """
+    if weights is None:
+        return np.sum(arr, axis=(0, 1))
+    return np.einsum('xyzv,xyz->zv', arr, weights)
+
+
+def _slice_counts(shape, mask=None):
+    """ Number of voxels in each slice of a volume of `shape`, within `mask`
+    """
+    if mask is None:
+        return np.full(shape[2], shape[0] * shape[1])
+    return np.count_nonzero(mask, axis=(0, 1))
+
+
+class SliceDvarsAccumulator:
+    """ Calculate dvars for each slice from blocks of consecutive volumes
+
+    Dvars for a slice is the square root of the mean of the squared voxel
+    differences in that slice, between each volume and the one before.
+
+    Parameters
+    ----------
+    pad_first : bool, optional
+        If True, the result starts with NaN for the first volume, so there is
+        one value per volume.  Default is False, giving n-1 values for n
+        volumes.
+    mask : 3D boolean array, optional
+        If given, only use voxels where `mask` is True.  Slices with no voxels
+        in `mask` have NaN values.
+    """
+
+    def __init__(self, pad_first=False, mask=None):
+        self._pad_first = pad_first
+        self._sums = []
+        self._prev_vol = None
+        self._mask = None if mask is None else np.asarray(mask, dtype=bool)
+        self._weights = (None if mask is None
+                         else self._mask.astype(np.float64))
+        self._counts = None
+
+    def update(self, block):
+        """ Add 4D `block` of volumes, following volumes already added
+        """
+        if self._counts is None:
+            self._counts = _slice_counts(block.shape, self._mask)
+            if self._pad_first:
+                self._sums.append(np.full((block.shape[2], 1), np.nan))
+        if self._prev_vol is not None:
+            first_diff = (block[..., :1] - self._prev_vol) ** 2
+            self._sums.append(_slice_sums(first_diff, self._weights))
+        vol_diff = np.subtract(block[..., 1:], block[..., :-1])
+        np.square(vol_diff, out=vol_diff)
+        self._sums.append(_slice_sums(vol_diff, self._weights))
+        self._prev_vol = block[..., -1:].copy()
+
+    def result(self):
+        """ Return (slices, volumes) array of slice dvars for volumes so far
+        """
+        if self._counts is None:
+            return np.zeros((0, 0))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(np.concatenate(self._sums, axis=1) /
+                           self._counts[:, None])
+
+    def volume_result(self):
+        """ Return 1D array of dvars for whole volumes, from the slice sums
+
+        This is the same as :class:`DvarsAccumulator` with the same `mask`,
+        without calculating the squared differences again.
+        """
+        if self._counts is None:
+            return np.zeros(0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(np.sum(np.concatenate(self._sums, axis=1), axis=0)
+                           / np.sum(self._counts))
+
+
+class SliceMeanAccumulator:
+    """ Calculate mean of each slice from blocks of volumes
+
+    Parameters
+    ----------
+    mask : 3D boolean array, optional
+        If given, only use voxels where `mask` is True.  Slices with no voxels
+        in `mask` have NaN values.
+    """
 
-    img_data = img.get_fdata()
-    n_voxels = np.prod(img_data.shape[:-1])
-    img_data_reshaped = np.reshape(img_data, (n_voxels, img_data.shape[-1]))
-    vol_diff = np.diff(img_data_reshaped, axis=1)
+    def __init__(self, mask=None):
+        self._sums = []
+        self._mask = None if mask is None else np.asarray(mask, dtype=bool)
+        self._weights = (None if mask is None
+                         else self._mask.astype(np.float64))
+        self._counts = None
 
-    return np.sqrt(np.mean(vol_diff ** 2, axis=0))
+    def update(self, block):
+        """ Add 4D `block` of volumes, following volumes already added
+        """
+        if self._counts is None:
+            self._counts = _slice_counts(block.shape, self._mask)
+        self._sums.append(_slice_sums(block, self._weights))
 
-    # raise NotImplementedError('Code up this function')
+    def result(self):
+        """ Return (slices, volumes) array of slice means for volumes so far
+        """
+        if self._counts is None:
+            return np.zeros((0, 0))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (np.concatenate(self._sums, axis=1) /
+                    self._counts[:, None])
@@ -0,0 +1,153 @@
+""" Detect outlier volumes one volume at a time, as a run is acquired
+
+:class:`OnlineDetector` takes volumes one at a time, calculates the DVARS, SPM
+global and PCA variance metrics for each new volume, and compares each value
+to the running mean and standard deviation of the earlier values of the same
+metric.  It keeps only the previous volume and a few numbers per metric, so
+memory use does not grow with the number of volumes.
+
+Test the detector on an existing image with :func:`iter_online_outliers`,
+which replays the image volume by volume.
+"""
+
+import numpy as np
+
+from .metrics import DvarsAccumulator, pca_variance
+from .spm_funcs import spm_globals
+from .volumes import iter_volumes
+
+# Metrics calculated by OnlineDetector.
+ONLINE_METRICS = ('dvars', 'spm_global', 'pca_variance')
+
+
+class RunningStats:
+    """ Running mean and variance of values, with Welford's algorithm
+
+    See: https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self._m2 = 0.
+
+    def update(self, value):
+        """ Add `value` to the values
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def var(self):
+        """ Variance of values so far, as for ``np.var``; NaN for no values
+        """
+        if self.count == 0:
+            return np.nan
+        return self._m2 / self.count
+
+    @property
+    def std(self):
+        """ Standard deviation of values so far, as for ``np.std``
+        """
+        return np.sqrt(self.var)
+
+
+class OnlineDetector:
+    """ Detect outlier volumes, one volume at a time
+
+    A volume is an outlier for a metric if its value is more than `n_std`
+    standard deviations above the mean of the values for the earlier volumes,
+    as for :func:`findoutlie.detectors.mean_std_detector`.  All values except
+    NaN, including outliers, go into the running mean and standard deviation.
+
+    Parameters
+    ----------
+    n_std : float, optional
+        Number of standard deviations above the mean for the threshold.
+        Default is 2.
+    min_volumes : int, optional
+        Number of earlier values for a metric needed before checking for
+        outliers on that metric.  Default is 5.
+    mask : 3D boolean array, optional
+        If given, only use voxels where `mask` is True.  See
+        :func:`findoutlie.engine.compute_metrics`.
+    """
+
+    def __init__(self, n_std=2, min_volumes=5, mask=None):
+        self.n_std = n_std
+        self.min_volumes = min_volumes
+        self._mask = None if mask is None else np.asarray(mask, dtype=bool)
+        self.stats = {name: RunningStats() for name in ONLINE_METRICS}
+        self.n_vols = 0
+        self.outliers = []
+        self._dvars = DvarsAccumulator(mask=mask)
+
+    def metrics_for(self, vol):
+        """ Return dictionary of metric values for new volume `vol`
+
+        There is no DVARS value for the first volume.
+        """
+        vol = np.asarray(vol, dtype=np.float64)
+        values = {}
+        data = vol[..., None]
+        values['spm_global'] = spm_globals(data, mask=self._mask)[0]
+        values['pca_variance'] = pca_variance(data, mask=self._mask)[0]
+        self._dvars.update(data)
+        dvals = self._dvars.pop_values()
+        if len(dvals):
+            values['dvars'] = dvals[0]
+        return values
+
+    def add_volume(self, vol):
+        """ Add next volume `vol` and check it for outliers
+
+        Parameters
+        ----------
+        vol : 3D array
+            Next volume of the run.
+
+        Returns
+        -------
+        flags : dict
+            Dictionary with keys being metric names and values being True
+            where `vol` is an outlier for that metric.
+        """
+        flags = {}
+        for name, value in self.metrics_for(vol).items():
+            stats = self.stats[name]
+            # NaN values, e.g. for constant volumes, are never outliers, and
+            # are left out of the statistics.
+            if np.isnan(value):
+                flags[name] = False
+                continue
+            flags[name] = bool(stats.count >= self.min_volumes and
+                               value > stats.mean + self.n_std * stats.std)
+            stats.update(value)
+        if any(flags.values()):
+            self.outliers.append(self.n_vols)
+        self.n_vols += 1
+        return flags
+
+
+def iter_online_outliers(img, **kwargs):
+    """ Replay 4D image `img` volume by volume through an online detector
+
+    Parameters
+    ----------
+    img : str or nibabel image
+        Filename of 4D image, or 4D nibabel image.
+    \\*\\*kwargs
+        Keyword arguments for :class:`OnlineDetector`.
+
+    Yields
+    ------
+    vol_no : int
+        Index of volume.
+    flags : dict
+        Outlier flags for volume.  See :meth:`OnlineDetector.add_volume`.
+    """
+    detector = OnlineDetector(**kwargs)
+    for vol_no, vol in enumerate(iter_volumes(img, dtype=np.float64)):
+        yield vol_no, detector.add_volume(vol)
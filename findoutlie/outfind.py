@@ -2,71 +2,480 @@
 """
 
 from pathlib import Path
-import nibabel as nib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack, closing
+from functools import partial
+from itertools import islice
+import logging
+import os
+
 import numpy as np
-import pandas as pd
-from sklearn.decomposition import PCA
-from sklearn.preprocessing import StandardScaler
 
+from . import profiling
+from .detectors import iqr_detector, mean_std_detector
+from .engine import compute_metrics
+from .utils import file_hash, read_manifests
+
+logger = logging.getLogger(__name__)
+
+
+def cached_metrics(fname, cache, sha1=None, memory_budget=None, mask=None,
+                   prefetch=0, pca_method='eigh'):
+    """ Return table of all metrics for `fname`, using `cache` if possible
+
+    Parameters
+    ----------
+    fname : str
+        Filename of file containing 4D image.
+    cache : MetricCache
+        Cache of metric tables.  See :mod:`findoutlie.cache`.
+    sha1 : str, optional
+        SHA1 hash of `fname`, if already known, for example from a
+        ``hash_list.txt`` file.  Default is to calculate the hash.
+    memory_budget : int, optional
+        See :func:`findoutlie.engine.compute_metrics`.
+    mask : None or 'auto', optional
+        If 'auto', restrict metrics to a brain mask.  See
+        :func:`findoutlie.engine.compute_metrics`.  Masked and unmasked
+        metrics are cached separately.
+    prefetch : int, optional
+        Number of blocks to read ahead.  See
+        :func:`findoutlie.engine.compute_metrics`.
+    pca_method : {'eigh', 'power'}, optional
+        Method for the largest eigenvalue in the PCA variance metric.  See
+        :func:`findoutlie.engine.compute_metrics`.  Metrics from
+        each method are cached separately.
+
+    Returns
+    -------
+    table : dict
+        Dictionary with keys being metric names and values being 1D arrays
+        with one value per volume.
+    """
+    if mask is not None and not (isinstance(mask, str) and mask == 'auto'):
+        raise ValueError("Can only cache metrics for mask of None or 'auto'")
+    if sha1 is None:
+        sha1 = file_hash(fname)
+    variant = '-'.join(([] if mask is None else ['mask']) +
+                       ([] if pca_method == 'eigh' else [pca_method]))
+    table = cache.get(sha1, variant)
+    if table is None:
+        table = compute_metrics(fname, memory_budget=memory_budget,
+                                mask=mask, prefetch=prefetch,
+                                pca_method=pca_method)
+        cache.put(sha1, table, variant)
+    return table
+
+
+def run_metrics(fname, metrics=None, cache=None, sha1=None,
+                memory_budget=None, mask=None, prefetch=0, pca_method='eigh'):
+    """ Return table of `metrics` for `fname`, from `cache` if given
+
+    Parameters
+    ----------
+    fname : str
+        Filename of file containing 4D image.
+    metrics : sequence of str, optional
+        Names of metrics to calculate.  See
+        :func:`findoutlie.engine.compute_metrics`.  Ignored if `cache` is
+        given, because the cache stores all metrics.
+    cache : MetricCache, optional
+        If given, get metrics from, and store metrics in, this cache.  See
+        :func:`cached_metrics`.
+    sha1 : str, optional
+        SHA1 hash of `fname`, if already known.  Only used with `cache`.
+    memory_budget : int, optional
+        See :func:`findoutlie.engine.compute_metrics`.
+    mask : 3D boolean array or 'auto', optional
+        If given, restrict metrics to voxels in this brain mask.  See
+        :func:`findoutlie.engine.compute_metrics`.
+    prefetch : int, optional
+        Number of blocks to read ahead.  See
+        :func:`findoutlie.engine.compute_metrics`.
+    pca_method : {'eigh', 'power'}, optional
+        Method for the largest eigenvalue in the PCA variance metric.  See
+        :func:`findoutlie.engine.compute_metrics`.
+
+    Returns
+    -------
+    table : dict
+        Dictionary with keys being metric names and values being 1D arrays
+        with one value per volume.
+    """
+    if cache is None:
+        return compute_metrics(fname, metrics, memory_budget=memory_budget,
+                               mask=mask, prefetch=prefetch,
+                               pca_method=pca_method)
+    return cached_metrics(fname, cache, sha1, memory_budget, mask, prefetch,
+                          pca_method)
+
+
+def detect_outliers(fname, memory_budget=None, detector=mean_std_detector,
+                    cache=None, sha1=None, mask=None, prefetch=0,
+                    pca_method='eigh'):
+    """ Return indices of outlier volumes in 4D image `fname`
+
+    Parameters
+    ----------
+    fname : str
+        Filename of file containing 4D image.
+    memory_budget : int, optional
+        Maximum size in bytes of each block of volumes read from `fname`.  See
+        :func:`findoutlie.engine.compute_metrics`.
+    detector : callable, optional
+        Function taking 1D array of values, returning boolean array where True
+        means the value is an outlier.  See :mod:`findoutlie.detectors`.  The
+        default flags volumes where the proportion of variance explained by
+        the first principal component is more than 2 standard deviations
+        above the mean.
+    cache : MetricCache, optional
+        If given, get metrics from, and store metrics in, this cache.  See
+        :func:`cached_metrics`.
+    sha1 : str, optional
+        SHA1 hash of `fname`, if already known.  Only used with `cache`.
+    mask : 3D boolean array or 'auto', optional
+        If given, restrict metrics to voxels in this brain mask.  See
+        :func:`findoutlie.engine.compute_metrics`.
+    prefetch : int, optional
+        Number of blocks to read ahead.  See
+        :func:`findoutlie.engine.compute_metrics`.
+    pca_method : {'eigh', 'power'}, optional
+        Method for the largest eigenvalue in the PCA variance metric.  See
+        :func:`findoutlie.engine.compute_metrics`.
+
+    Returns
+    -------
+    volume_outliers : 1D array
+        Indices of outlier volumes.
+    """
+    table = run_metrics(fname, ['pca_variance'], cache, sha1, memory_budget,
+                        mask, prefetch, pca_method)
+    return _table_outliers(table, detector)
 
-def detect_outliers(fname):
 
-    # Load image and get the data
-    img = nib.load(fname)
-    data = img.get_fdata()
+def detect_slice_outliers(fname, memory_budget=None, detector=iqr_detector,
+                          mask=None, prefetch=0):
+    """ Return slice and volume indices of outlier slices in 4D image `fname`
 
-    # Calculate variance within each 3D volume
-    variance = np.zeros(data.shape[-1])
-    for i in range(0, data.shape[-1]):
+    Calculate dvars and the mean for each slice of each volume in one pass
+    over the image, and run `detector` on all slices at once, comparing the
+    values for each slice across volumes.  A slice is an outlier if it is an
+    outlier for either metric.
 
-        curr_data = data[:, :, :, i]
-        n_voxels = np.prod(curr_data.shape[:-1])
-        # Reshape the data of volume [n_voxels_per_slice, number_of_slices]
-        img_data_reshaped = np.reshape(curr_data, (n_voxels, curr_data.shape[-1]))
+    Parameters
+    ----------
+    fname : str
+        Filename of file containing 4D image.
+    memory_budget : int, optional
+        Maximum size in bytes of each block of volumes read from `fname`.  See
+        :func:`findoutlie.engine.compute_metrics`.
+    detector : callable, optional
+        Function taking a 2D array and an `axis` keyword argument, returning
+        boolean array where True means the value is an outlier.  See
+        :mod:`findoutlie.detectors`.  The default uses the interquartile
+        range, which finds both high and low values, such as slices with
+        signal dropout.
+    mask : 3D boolean array or 'auto', optional
+        If given, restrict metrics to voxels in this brain mask.  See
+        :func:`findoutlie.engine.compute_metrics`.
+    prefetch : int, optional
+        Number of blocks to read ahead.  See
+        :func:`findoutlie.engine.compute_metrics`.
 
-        # Prepare the data for PCA
-        df_data = pd.DataFrame(img_data_reshaped)
-        feat_cols = [f'Slice_{i}' for i in range(df_data.shape[1])]
+    Returns
+    -------
+    slice_outliers : 2D array
+        Array of shape (n_outliers, 2), where each row is the slice index and
+        volume index of an outlier slice, sorted by volume, then slice.
+    """
+    table = compute_metrics(fname, ['slice_dvars', 'slice_mean'],
+                            memory_budget=memory_budget, mask=mask,
+                            prefetch=prefetch)
+    with profiling.stage('detect'):
+        outlier_tf = np.logical_or(detector(table['slice_dvars'], axis=-1),
+                                   detector(table['slice_mean'], axis=-1))
+        slice_indices, vol_indices = np.nonzero(outlier_tf.T)[::-1]
+    return np.column_stack([slice_indices, vol_indices])
 
-        # Standardize the data
-        x = df_data.loc[:, :].values
-        y = StandardScaler().fit_transform(x)
 
-        # PCA
-        pca = PCA(n_components=2)
-        principalComponents = pca.fit_transform(x)
-        principal_Df = pd.DataFrame(data=principalComponents,
-                                    columns=['PC1', 'PC2'])
-        variance[i] = pca.explained_variance_ratio_[0]
+def _table_outliers(table, detector):
+    """ Return indices of outlier volumes from metric `table`
+    """
+    # Variance explained by first PCA component within each 3D volume
+    variance = table['pca_variance']
+    with profiling.stage('detect'):
+        return np.flatnonzero(detector(variance))
 
-    variance = variance.tolist()
-    variance_mean = np.mean(variance, axis=0)
-    variance_std = np.std(variance, axis=0)
 
-    # Find variance_outliers using mean and standard deviation
-    variance_outliers = [variance_volume for variance_volume in variance if (np.abs(variance_volume) > variance_mean + 2 * variance_std)]
-    volume_outliers = [variance.index(i) for i in variance_outliers]
+def _analyse_or_error(fname, sha1=None, detector=mean_std_detector,
+                      cache=None, metrics=('pca_variance',), profile=False,
+                      mask=None, prefetch=0, pca_method='eigh'):
+    """ Return outliers, metric table and profile summary for `fname`
 
-    return volume_outliers
+    If finding the outliers raises an error, return the exception and None
+    for the outliers and table.  The profile summary is None unless `profile`
+    is True.
+    """
+    was_enabled = profiling.is_enabled()
+    profiling.enable(was_enabled or profile)
+    try:
+        with profiling.file_profile(fname) as file_prof:
+            try:
+                table = run_metrics(fname, metrics, cache, sha1, mask=mask,
+                                    prefetch=prefetch, pca_method=pca_method)
+                outliers = _table_outliers(table, detector)
+            except Exception as err:
+                outliers, table = err, None
+    finally:
+        profiling.enable(was_enabled)
+    summary = file_prof.summary() if profile else None
+    return outliers, table, summary
+
+
+def _manifest_hashes(data_directory):
+    """ Return dict of filename: hash from ``hash_list.txt`` files, if any
+    """
+    data_directory = Path(data_directory)
+    if next(data_directory.rglob('group-*/hash_list.txt'), None) is None:
+        return {}
+    try:
+        entries = read_manifests(data_directory)
+    except (FileExistsError, ValueError):
+        return {}
+    return {str(data_directory / filename): sha1
+            for sha1, filename in entries}
+
+
+def shard_fnames(fnames, shard, n_shards):
+    """ Return filenames in `fnames` for shard number `shard` of `n_shards`
+
+    Split the files so each shard has about the same total file size.  Take
+    the files from largest to smallest, and put each in the shard with the
+    smallest total size so far.  The split only depends on the filenames and
+    sizes, so separate processes, for example jobs in a cluster job array,
+    agree on the split.
+
+    Parameters
+    ----------
+    fnames : sequence of str
+        Filenames to split.
+    shard : int
+        Index of shard, from 0 to ``n_shards - 1``.
+    n_shards : int
+        Number of shards.
+
+    Returns
+    -------
+    shard_fnames : list
+        Filenames for shard `shard`, in sorted order.
+    """
+    if not 0 <= shard < n_shards:
+        raise ValueError(f'Shard should be in 0 to {n_shards - 1}, '
+                         f'but is {shard}')
+    sizes = {str(fname): os.path.getsize(fname) for fname in fnames}
+    totals = [0] * n_shards
+    selected = []
+    for fname in sorted(sizes, key=lambda fname: (-sizes[fname], fname)):
+        size = sizes[fname]
+        index = totals.index(min(totals))
+        totals[index] += size
+        if index == shard:
+            selected.append(fname)
+    return sorted(selected)
+
+
+def _ordered_map(make_executor, func, *iterables, window):
+    """ Like ``executor.map``, with at most `window` calls submitted at once
+
+    Results come back in input order.  Only submitting a few calls ahead keeps
+    the number of finished, unused results small, and means stopping early
+    only waits for the calls already submitted.
+
+    A worker process that dies, for example when the system kills it for
+    using too much memory, breaks the executor, and all unfinished calls
+    fail.  We then run the first unfinished call again, on its own, in a new
+    executor.  If that also breaks, its result is the ``BrokenProcessPool``
+    exception, rather than a return value of `func`.  The other unfinished
+    calls go to another new executor.
+
+    Parameters
+    ----------
+    make_executor : callable
+        Function returning a new ``ProcessPoolExecutor``.
+    func : callable
+        Function to call with the arguments from `iterables`.
+    \\*iterables : iterables
+        Iterables giving the arguments for each call.
+    window : int
+        Maximum number of calls submitted and not yet yielded.
+    """
+    args = zip(*iterables)
+    executor = make_executor()
+    try:
+        pending = deque((call_args, executor.submit(func, *call_args))
+                        for call_args in islice(args, window))
+        while pending:
+            call_args, future = pending.popleft()
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                executor.shutdown()
+                result = _call_alone(make_executor, func, call_args)
+                executor = make_executor()
+                pending = deque(
+                    (other_args, executor.submit(func, *other_args))
+                    for other_args, _ in pending)
+            for call_args in islice(args, 1):
+                pending.append((call_args, executor.submit(func, *call_args)))
+            yield result
+    finally:
+        executor.shutdown()
+
+
+def _call_alone(make_executor, func, call_args):
+    """ Return result of `func` on `call_args` in a new executor
+
+    Return the ``BrokenProcessPool`` exception if the call breaks the
+    executor.
+    """
+    with make_executor() as executor:
+        try:
+            return executor.submit(func, *call_args).result()
+        except BrokenProcessPool as err:
+            return err
+
+
+def iter_outliers(data_directory, n_jobs=1, detector=mean_std_detector,
+                  cache=None, store=None, skip=(), profile_callback=None,
+                  mask=None, shard=None, prefetch=0, pca_method='eigh'):
+    """ Yield filenames and outlier indices for images in `data_directory`
+
+    Each image is yielded as soon as it and all images before it are done, so
+    callers can write results as they go.
+
+    Parameters
+    ----------
+    data_directory : str
+        Directory containing containing images.
+    n_jobs : int, optional
+        Number of processes used to analyse images.  Default is 1 (analyse
+        images one after another in this process).
+    detector : callable, optional
+        Outlier detector for each image.  See :func:`detect_outliers`.
+    cache : MetricCache, optional
+        If given, get metrics from, and store metrics in, this cache.  Hashes
+        recorded in ``hash_list.txt`` files are used as cache keys, so run
+        ``validate_data`` first; other files are hashed.
+    store : MetricStore, optional
+        If given, add all metrics for each image not already in `store` to
+        `store`.  See :mod:`findoutlie.store`.
+    skip : container of str, optional
+        Filenames of images to leave out, for example because they were done
+        by an earlier run.
+    profile_callback : callable, optional
+        If given, profile the stages of analysing each image, and call
+        ``profile_callback(summary)`` with the profile summary for each image.
+        See :mod:`findoutlie.profiling`.
+    mask : None or 'auto', optional
+        If 'auto', restrict metrics for each image to a brain mask made from
+        the mean of the first block of volumes.  See
+        :func:`findoutlie.engine.compute_metrics`.
+    shard : tuple, optional
+        If given, ``(index, n_shards)`` to only analyse the images for shard
+        `index` of `n_shards`.  See :func:`shard_fnames`.
+    prefetch : int, optional
+        Number of blocks of volumes to read ahead in a background thread,
+        while calculating metrics for the current block.  See
+        :func:`findoutlie.engine.compute_metrics`.
+    pca_method : {'eigh', 'power'}, optional
+        Method for the largest eigenvalue in the PCA variance metric.  See
+        :func:`findoutlie.engine.compute_metrics`.
+
+    Yields
+    ------
+    fname : str
+        Filename of image, in sorted filename order.
+    outliers : 1D array or Exception
+        Indices of outlier volumes, or the exception raised if analysing the
+        image failed.  Errors do not stop the other images being analysed.
+        If the worker process analysing the image died, for example from
+        running out of memory, the exception is ``BrokenProcessPool``.
+    """
+    image_fnames = sorted(Path(data_directory).glob('**/sub-*.nii.gz'))
+    if shard is not None:
+        image_fnames = [Path(fname) for fname in
+                        shard_fnames(image_fnames, *shard)]
+    image_fnames = [fname for fname in image_fnames if str(fname) not in skip]
+    hashes = {} if cache is None else _manifest_hashes(data_directory)
+    sha1s = [hashes.get(str(fname)) for fname in image_fnames]
+    # The store has all metrics; otherwise we only need those for detection.
+    metrics = None if store is not None else ['pca_variance']
+    find_one = partial(_analyse_or_error, detector=detector, cache=cache,
+                       metrics=metrics, profile=profile_callback is not None,
+                       mask=mask, prefetch=prefetch, pca_method=pca_method)
+    with ExitStack() as stack:
+        if n_jobs > 1:
+            # Shut down the executor when the caller stops early.
+            results = stack.enter_context(closing(_ordered_map(
+                partial(ProcessPoolExecutor, max_workers=n_jobs), find_one,
+                image_fnames, sha1s, window=2 * n_jobs)))
+        else:
+            results = map(find_one, image_fnames, sha1s)
+        for fname, result in zip(image_fnames, results):
+            if isinstance(result, BrokenProcessPool):
+                # The worker process died analysing this image.
+                result = (result, None, None)
+            outliers, table, summary = result
+            if profile_callback is not None and summary is not None:
+                profile_callback(summary)
+            if isinstance(outliers, Exception):
+                logger.error(
+                    f'Could not find outliers for {fname}: {outliers}')
+            elif store is not None and fname not in store:
+                store.append(fname, table)
+            yield str(fname), outliers
 
 
-def find_outliers(data_directory):
+def find_outliers(data_directory, n_jobs=1, detector=mean_std_detector,
+                  cache=None, store=None, mask=None, prefetch=0,
+                  pca_method='eigh'):
     """ Return filenames and outlier indices for images in `data_directory`.
 
     Parameters
     ----------
     data_directory : str
         Directory containing containing images.
+    n_jobs : int, optional
+        Number of processes used to analyse images.  Default is 1 (analyse
+        images one after another in this process).
+    detector : callable, optional
+        Outlier detector for each image.  See :func:`detect_outliers`.
+    cache : MetricCache, optional
+        If given, get metrics from, and store metrics in, this cache.  See
+        :func:`iter_outliers`.
+    store : MetricStore, optional
+        If given, add all metrics for each image not already in `store` to
+        `store`.  See :mod:`findoutlie.store`.
+    mask : None or 'auto', optional
+        If 'auto', restrict metrics to a brain mask.  See
+        :func:`iter_outliers`.
+    prefetch : int, optional
+        Number of blocks to read ahead.  See :func:`iter_outliers`.
+    pca_method : {'eigh', 'power'}, optional
+        Method for the largest eigenvalue in the PCA variance metric.  See
+        :func:`iter_outliers`.
 
     Returns
     -------
     outlier_dict : dict
         Dictionary with keys being filenames and values being lists of outliers
-        for filename.
+        for filename, in sorted filename order.  If analysing a file raised an
+        error, the value for that filename is the exception, and the other
+        files are still analysed.
     """
-    image_fnames = Path(data_directory).glob('**/sub-*.nii.gz')
-    outlier_dict = {}
-    for fname in sorted(image_fnames):
-        outliers = detect_outliers(fname)
-        outlier_dict[str(fname)] = outliers
-    return outlier_dict
+    return dict(iter_outliers(data_directory, n_jobs=n_jobs,
+                              detector=detector, cache=cache, store=store,
+                              mask=mask, prefetch=prefetch,
+                              pca_method=pca_method))
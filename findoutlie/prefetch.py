@@ -0,0 +1,83 @@
+""" Read ahead from an iterable in a background thread
+
+Reading and decompressing image data mostly runs outside the Python global
+interpreter lock, as do most numpy calculations.  :func:`prefetch` gets the
+next items of an iterable, such as blocks of volumes from
+:func:`findoutlie.volumes.iter_volume_blocks`, in a background thread, while
+the caller works on the current item, so the disk and the CPU can both be
+busy.  The queue between the thread and the caller has a fixed maximum
+length, so memory use stays bounded.
+"""
+
+import queue
+import threading
+
+from . import profiling
+
+# Marks end of items in the queue.
+_END = object()
+
+# Seconds between checks that the caller still wants items.
+_POLL_INTERVAL = 0.1
+
+
+def prefetch(iterable, depth=1):
+    """ Yield items from `iterable`, getting up to `depth` items ahead
+
+    Parameters
+    ----------
+    iterable : iterable
+        Source of items.  Only the background thread uses it.
+    depth : int, optional
+        Maximum number of items waiting in the queue.  At most ``depth + 2``
+        items are in memory at once: those in the queue, the item being made
+        in the thread, and the item the caller is using.  0 or less gives the
+        items from `iterable` directly, with no thread.
+
+    Yields
+    ------
+    item : object
+        Next item from `iterable`.  An exception raised by `iterable` is
+        raised here, after the items before it.
+    """
+    if depth < 1:
+        yield from iterable
+        return
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    profile = profiling.current_profile()
+
+    def put(item):
+        # Return False if the caller has stopped taking items.
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        with profiling.use_profile(profile):
+            try:
+                for item in iterable:
+                    if not put((item, None)):
+                        return
+            except BaseException as err:
+                put((_END, err))
+            else:
+                put((_END, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, err = items.get()
+            if item is _END:
+                if err is not None:
+                    raise err
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
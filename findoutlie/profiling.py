@@ -0,0 +1,153 @@
+""" Time and count bytes for stages of the outlier pipeline
+
+Code marks stages with::
+
+    with profiling.stage('read', nbytes):
+        ...
+
+When profiling is off (the default), :func:`stage` returns a context manager
+that does nothing, so marking stages costs almost nothing.  When profiling is
+on, stages inside a :func:`file_profile` block add their time, call count and
+bytes to the profile for that file.  Each thread has its own current profile,
+so threads can profile different files at the same time.  A helper thread can
+add to the profile of the thread it works for, with :func:`use_profile`.
+"""
+
+from contextlib import contextmanager, nullcontext
+import threading
+import time
+
+_enabled = False
+
+_local = threading.local()
+
+_NULL_STAGE = nullcontext()
+
+
+def enable(enabled=True):
+    """ Turn profiling on (or off with ``enabled=False``) in this process
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled():
+    """ Return True if profiling is on in this process
+    """
+    return _enabled
+
+
+class Profile:
+    """ Times, call counts and bytes for stages while processing one file
+
+    Parameters
+    ----------
+    fname : str
+        Filename being processed.
+    """
+
+    def __init__(self, fname):
+        self.fname = str(fname)
+        self.stages = {}
+        self.total_time = 0.
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, nbytes=0):
+        """ Add `seconds` and `nbytes` to stage `name`
+        """
+        with self._lock:
+            stage = self.stages.setdefault(
+                name, {'time': 0., 'calls': 0, 'bytes': 0})
+            stage['time'] += seconds
+            stage['calls'] += 1
+            stage['bytes'] += int(nbytes)
+
+    def summary(self):
+        """ Return dictionary summarizing profile, suitable for JSON
+        """
+        return {'fname': self.fname, 'total_time': self.total_time,
+                'stages': self.stages}
+
+
+class _Stage:
+    """ Context manager adding time of block to stage of profile
+    """
+
+    def __init__(self, profile, name, nbytes):
+        self._profile = profile
+        self._name = name
+        self._nbytes = nbytes
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._profile.add(self._name, time.perf_counter() - self._start,
+                          self._nbytes)
+
+
+def stage(name, nbytes=0):
+    """ Return context manager timing stage `name` of current file profile
+
+    Parameters
+    ----------
+    name : str
+        Name of stage, e.g. ``'read'``.
+    nbytes : int, optional
+        Number of bytes processed in this stage.
+
+    Returns
+    -------
+    context : context manager
+        Does nothing if profiling is off, or there is no current file profile.
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return _NULL_STAGE
+    return _Stage(profile, name, nbytes)
+
+
+def current_profile():
+    """ Return current file profile for this thread, or None
+    """
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def use_profile(profile):
+    """ Make `profile` the current file profile for this thread in this block
+
+    Use this in helper threads, to add stages to the profile of the file
+    being processed.  Stages run in different threads can overlap, so their
+    times can add up to more than the total time.
+    """
+    previous = current_profile()
+    _local.profile = profile
+    try:
+        yield profile
+    finally:
+        _local.profile = previous
+
+
+@contextmanager
+def file_profile(fname):
+    """ Collect stages run inside this block into a profile for `fname`
+
+    Yields
+    ------
+    profile : Profile or None
+        Profile for `fname`, or None if profiling is off.
+    """
+    if not _enabled:
+        yield None
+        return
+    profile = Profile(fname)
+    start = time.perf_counter()
+    try:
+        with use_profile(profile):
+            yield profile
+    finally:
+        profile.total_time = time.perf_counter() - start
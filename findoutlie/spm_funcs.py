@@ -23,8 +23,6 @@ or better, in IPython::
 # Any imports you need
 import numpy as np
 
-import nibabel as nib
-
 
 def spm_global(vol):
     """ Calculate SPM global metric for array `vol`
@@ -43,23 +41,99 @@ def spm_global(vol):
     return np.mean(vol[vol > T])
 
 
-def get_spm_globals(fname):
+def spm_globals(data, dtype=None, mask=None):
+    """ Calculate SPM global metric for each volume in 4D array `data`
+
+    Gives the same values as :func:`spm_global` on each volume, using
+    reductions over a voxels by volumes view of `data`.
+
+    Parameters
+    ----------
+    data : array
+        Image data, with volumes on the last axis.
+    dtype : dtype, optional
+        Data type for calculation, e.g. ``np.float32`` to halve memory use
+        compared to float64.  Default is the data type of `data`.
+    mask : 3D boolean array, optional
+        If given, only use voxels where `mask` is True.
+
+    Returns
+    -------
+    g_vals : 1D array
+        SPM global metric for each volume in `data`.
+    """
+    # Voxel order does not matter here, so reshape without a copy for both C
+    # and Fortran ordered arrays.
+    if mask is None:
+        vox_by_vol = np.reshape(data, (-1, data.shape[-1]), order='A')
+    else:
+        vox_by_vol = data[mask]
+    if dtype is not None:
+        vox_by_vol = vox_by_vol.astype(dtype, copy=False)
+    thresholds = np.mean(vox_by_vol, axis=0) / 8
+    above = vox_by_vol > thresholds
+    sums = np.sum(vox_by_vol, axis=0, where=above)
+    return sums / np.count_nonzero(above, axis=0)
+
+
+def get_spm_globals(fname, memory_budget=None, dtype=np.float64, mask=None):
     """ Calculate SPM global metrics for volumes in image filename `fname`
 
     Parameters
     ----------
     fname : str
         Filename of file containing 4D image
+    memory_budget : int, optional
+        Maximum size in bytes of each block of volumes read from `fname`.  See
+        :func:`findoutlie.volumes.iter_volume_blocks`.
+    dtype : dtype, optional
+        Data type for reading and calculation.  ``np.float32`` halves memory
+        use, at some cost in precision.
+    mask : 3D boolean array, optional
+        If given, only use voxels where `mask` is True.
 
     Returns
     -------
-    spm_vals : array
+    spm_vals : 1D array
         SPM global metric for each 3D volume in the 4D image.
     """
-    img = nib.load(fname)
-    data = img.get_fdata()
-    spm_vals = []
-    for i in range(data.shape[-1]):
-        vol = data[..., i]
-        spm_vals.append(spm_global(vol))
-    return spm_vals
+    # Import here, so the rest of this file also works as a plain module,
+    # without the findoutlie package on the Python path.
+    from findoutlie import profiling
+    from findoutlie.volumes import iter_volume_blocks
+
+    accumulator = SpmGlobalAccumulator(mask=mask)
+    for block in iter_volume_blocks(fname, memory_budget=memory_budget,
+                                    dtype=dtype):
+        with profiling.stage('metric:spm_global'):
+            accumulator.update(block)
+    return accumulator.result()
+
+
+class SpmGlobalAccumulator:
+    """ Calculate SPM global metric from blocks of volumes
+
+    Parameters
+    ----------
+    mask : 3D boolean array, optional
+        If given, only use voxels where `mask` is True.
+    """
+
+    def __init__(self, mask=None):
+        self._spm_vals = []
+        self._mask = mask
+
+    def update(self, block):
+        """ Add 4D `block` of volumes, following volumes already added
+        """
+        self._spm_vals.append(spm_globals(block, mask=self._mask))
+
+    def update_voxels(self, block):
+        """ Add 2D (voxels, volumes) `block`, with only the voxels in the mask
+        """
+        self._spm_vals.append(spm_globals(block))
+
+    def result(self):
+        """ Return 1D array of SPM global values for volumes added so far
+        """
+        return np.concatenate(self._spm_vals + [[]])
@@ -0,0 +1,181 @@
+""" Columnar store of per-volume metrics for many runs
+
+A store is a directory containing:
+
+* ``<metric>.f8``: raw little-endian float64 values of one metric for all
+  volumes of all runs, one run after another;
+* ``index.jsonl``: one JSON line per run, giving the run filename, the offset
+  of its first volume in the metric files, and its number of volumes.
+
+Runs are added one at a time, by appending to the metric files, and then to
+the index.  Only one process should add to a store at a time; processes
+working in parallel should each have their own store, and then combine them
+with :meth:`MetricStore.extend`.
+
+Reading uses memory maps, so a metric for all runs is an array backed by the
+file, without reading the whole file into memory.
+"""
+
+from pathlib import Path
+import json
+
+import numpy as np
+
+STORE_DTYPE = np.dtype('<f8')
+
+INDEX_FNAME = 'index.jsonl'
+
+
+class MetricStore:
+    """ Store of per-volume metrics for many runs
+
+    Parameters
+    ----------
+    directory : str
+        Directory for store files.  Created when the first run is added.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self._runs = None
+        self._fnames = None
+
+    @property
+    def runs(self):
+        """ List of dicts with ``fname``, ``offset`` and ``n_vols`` for runs
+        """
+        if self._runs is None:
+            index_path = self.directory / INDEX_FNAME
+            self._runs = []
+            if index_path.exists():
+                self._runs = [json.loads(line) for line in
+                              index_path.read_text().splitlines() if line]
+            self._fnames = {run['fname'] for run in self._runs}
+        return self._runs
+
+    @property
+    def metrics(self):
+        """ Sorted list of metric names in store
+        """
+        return sorted(path.stem for path in self.directory.glob('*.f8'))
+
+    @property
+    def n_vols(self):
+        """ Total number of volumes for all runs in store
+        """
+        if len(self.runs) == 0:
+            return 0
+        last = self.runs[-1]
+        return last['offset'] + last['n_vols']
+
+    def __len__(self):
+        return len(self.runs)
+
+    def __contains__(self, fname):
+        self.runs  # Read index, if not yet read.
+        return str(fname) in self._fnames
+
+    def append(self, fname, table):
+        """ Add metrics in `table` for run `fname` to the store
+
+        Parameters
+        ----------
+        fname : str
+            Filename of run.
+        table : dict
+            Dictionary with keys being metric names and values being 1D arrays
+            with one value per volume.  All runs in the store must have the
+            same metrics.
+        """
+        fname = str(fname)
+        n_vols = {len(values) for values in table.values()}
+        if len(n_vols) != 1:
+            raise ValueError('Metrics must have one value per volume')
+        n_vols = n_vols.pop()
+        if len(self.runs) and sorted(table) != self.metrics:
+            raise ValueError(f'Store has metrics {self.metrics}, '
+                             f'but {fname} has {sorted(table)}')
+        if fname in self:
+            raise ValueError(f'{fname} is already in store')
+        self.directory.mkdir(parents=True, exist_ok=True)
+        offset = self.n_vols
+        for name, values in table.items():
+            with open(self.directory / f'{name}.f8', 'r+b' if offset
+                      else 'wb') as fobj:
+                # Overwrite anything written by an interrupted append.
+                fobj.seek(offset * STORE_DTYPE.itemsize)
+                fobj.write(np.asarray(values, dtype=STORE_DTYPE).tobytes())
+                fobj.truncate()
+        run = {'fname': fname, 'offset': offset, 'n_vols': n_vols}
+        with open(self.directory / INDEX_FNAME, 'a') as fobj:
+            fobj.write(json.dumps(run) + '\n')
+        self.runs.append(run)
+        self._fnames.add(fname)
+
+    def column(self, metric):
+        """ Return values of `metric` for all volumes of all runs
+
+        Parameters
+        ----------
+        metric : str
+            Name of metric.
+
+        Returns
+        -------
+        values : 1D array
+            Read-only array memory-mapped from the store, with values for the
+            runs in the order they were added.  See :meth:`offsets`.
+        """
+        if self.n_vols == 0:
+            return np.zeros(0, dtype=STORE_DTYPE)
+        return np.memmap(self.directory / f'{metric}.f8', dtype=STORE_DTYPE,
+                         mode='r', shape=(self.n_vols,))
+
+    def offsets(self):
+        """ Return offsets of runs into :meth:`column` arrays
+
+        Returns
+        -------
+        offsets : 1D int array
+            Array with one more element than the number of runs, where the
+            values for run ``i`` are ``column[offsets[i]:offsets[i + 1]]``.
+        """
+        return np.array([run['offset'] for run in self.runs] + [self.n_vols],
+                        dtype=int)
+
+    def run(self, fname):
+        """ Return table of metrics for run `fname`
+
+        Returns
+        -------
+        table : dict
+            Dictionary with keys being metric names and values being 1D
+            read-only arrays with one value per volume.
+        """
+        for run in self.runs:
+            if run['fname'] == str(fname):
+                start, stop = run['offset'], run['offset'] + run['n_vols']
+                return {name: self.column(name)[start:stop]
+                        for name in self.metrics}
+        raise KeyError(f'{fname} is not in store')
+
+    def extend(self, other):
+        """ Add runs from store `other` that are not already in this store
+
+        Runs are added in filename order.
+
+        Parameters
+        ----------
+        other : MetricStore
+            Store to copy runs from.
+
+        Returns
+        -------
+        n_added : int
+            Number of runs added.
+        """
+        fnames = sorted(run['fname'] for run in other.runs
+                        if run['fname'] not in self)
+        for fname in fnames:
+            self.append(fname, other.run(fname))
+        return len(fnames)
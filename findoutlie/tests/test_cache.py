@@ -0,0 +1,56 @@
+""" Test cache module
+
+You can run the tests from the root directory (containing ``README.md``) with::
+
+    python3 -m pytest .
+"""
+
+import os
+
+import numpy as np
+
+from findoutlie.cache import MetricCache
+
+
+def test_metric_cache(tmp_path):
+    cache = MetricCache(tmp_path / 'cache')
+    assert cache.get('abc') is None
+    assert cache.entries() == []
+    table = {'dvars': np.array([np.nan, 1, 2]), 'pca_variance': np.ones(3)}
+    cache.put('abc', table)
+    cached = cache.get('abc')
+    assert set(cached) == set(table)
+    assert np.allclose(cached['dvars'], table['dvars'], equal_nan=True)
+    assert cache.path_for('abc').exists()
+
+
+def test_metric_cache_lru(tmp_path):
+    cache = MetricCache(tmp_path)
+    table = {'values': np.zeros(1000)}
+    for i, sha1 in enumerate(['a', 'b', 'c']):
+        cache.put(sha1, table)
+        # Make the order of use clear, whatever the file time resolution.
+        os.utime(cache.path_for(sha1), (i, i))
+    entry_size = cache.entries()[0][1]
+    assert cache.size() == entry_size * 3
+    # Using 'a' makes 'b' the least recently used.
+    cache.get('a')
+    removed = cache.prune(entry_size * 2)
+    assert removed == [cache.path_for('b')]
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    # Adding past the maximum size removes old entries.
+    cache.max_bytes = entry_size * 2
+    cache.put('d', table)
+    assert len(cache.entries()) == 2
+    assert cache.get('d') is not None
+
+
+def test_metric_cache_variant(tmp_path):
+    cache = MetricCache(tmp_path)
+    cache.put('abc', {'values': np.zeros(3)})
+    assert cache.get('abc', 'mask') is None
+    cache.put('abc', {'values': np.ones(3)}, 'mask')
+    assert np.all(cache.get('abc')['values'] == 0)
+    assert np.all(cache.get('abc', 'mask')['values'] == 1)
+    assert cache.path_for('abc', 'mask') != cache.path_for('abc')
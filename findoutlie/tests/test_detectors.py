@@ -31,7 +31,7 @@ import numpy as np
 
 # This import needs the directory containing the findoutlie directory
 # on the Python path.  See above.
-from findoutlie.detectors import iqr_detector
+from findoutlie.detectors import iqr_detector, mad_detector, mean_std_detector
 
 
 def test_iqr_detector():
@@ -47,7 +47,51 @@ def test_iqr_detector():
     assert np.all(example_values[is_outlier] == [10.2, 14.1, 15.1, 15.9, 16.4])
 
 
+def test_iqr_detector_2d():
+    example_values = np.array(
+        [10.2, 14.1, 14.4, 14.4, 14.4, 14.5, 14.5, 14.6, 14.7, 14.7, 14.7,
+         14.9, 15.1, 15.9, 16.4])
+    rng = np.random.default_rng(0)
+    runs = np.stack([example_values, rng.permutation(example_values),
+                     rng.normal(size=15)])
+    is_outlier = iqr_detector(runs, 1.5)
+    assert is_outlier.shape == runs.shape
+    for row, row_is_outlier in zip(runs, is_outlier):
+        assert np.all(row_is_outlier == iqr_detector(row, 1.5))
+    # Along the first axis
+    is_outlier = iqr_detector(runs.T, 1.5, axis=0)
+    assert np.all(is_outlier == iqr_detector(runs, 1.5).T)
+    # NaN values are ignored
+    with_nan = np.concatenate([[np.nan], example_values])
+    is_outlier = iqr_detector(with_nan, 1.5)
+    assert not is_outlier[0]
+    assert np.all(with_nan[is_outlier] == [10.2, 15.9, 16.4])
+
+
+def test_mean_std_detector():
+    values = np.zeros(20)
+    # Two volumes with equal values must both be found.
+    values[[3, 11]] = 10
+    assert list(np.flatnonzero(mean_std_detector(values))) == [3, 11]
+    # Low values are not outliers.
+    assert not np.any(mean_std_detector(-values))
+    assert not np.any(mean_std_detector(values, n_std=4))
+    runs = np.stack([values, np.roll(values, 1)])
+    assert np.all(mean_std_detector(runs) ==
+                  [mean_std_detector(values), mean_std_detector(runs[1])])
+
+
+def test_mad_detector():
+    values = np.array([1.0, 1.1, 0.9, 1.0, 1.05, 0.95, 5.0, -3.0])
+    assert list(np.flatnonzero(mad_detector(values))) == [6, 7]
+    assert np.all(mad_detector(np.stack([values, values]).T, axis=0) ==
+                  mad_detector(values)[:, None])
+
+
 if __name__ == '__main__':
     # File being executed as a script
     test_iqr_detector()
+    test_iqr_detector_2d()
+    test_mean_std_detector()
+    test_mad_detector()
     print('Tests passed')
@@ -0,0 +1,153 @@
+""" Test engine module
+
+You can run the tests from the root directory (containing ``README.md``) with::
+
+    python3 -m pytest .
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+import nibabel as nib
+
+import pytest
+
+from findoutlie.engine import compute_metrics
+from findoutlie.masks import mean_mask
+from findoutlie.metrics import dvars, pca_variance
+from findoutlie.spm_funcs import get_spm_globals
+
+MY_DIR = Path(__file__).parent
+EXAMPLE_FILENAME = MY_DIR / 'ds107_sub012_t1r2_small.nii'
+
+
+def test_compute_metrics():
+    img = nib.load(EXAMPLE_FILENAME)
+    n_vols = img.shape[-1]
+    vol_bytes = np.prod(img.shape[:-1]) * 8
+    for memory_budget in (None, vol_bytes * 5):
+        table = compute_metrics(EXAMPLE_FILENAME, memory_budget=memory_budget)
+        assert set(table) == {'dvars', 'spm_global', 'pca_variance'}
+        assert all(len(values) == n_vols for values in table.values())
+        assert np.isnan(table['dvars'][0])
+        assert np.allclose(table['dvars'][1:], dvars(img))
+        assert np.allclose(table['spm_global'],
+                           get_spm_globals(EXAMPLE_FILENAME))
+        assert np.allclose(table['pca_variance'],
+                           pca_variance(img.get_fdata()))
+    table = compute_metrics(img, ['spm_global'])
+    assert list(table) == ['spm_global']
+    with pytest.raises(ValueError):
+        compute_metrics(img, ['no_such_metric'])
+    power_table = compute_metrics(img, pca_method='power')
+    assert np.allclose(power_table['pca_variance'],
+                       pca_variance(img.get_fdata()))
+    with pytest.raises(ValueError):
+        compute_metrics(img, pca_method='svd')
+
+
+def test_compute_metrics_mask():
+    img = nib.load(EXAMPLE_FILENAME)
+    data = img.get_fdata()
+    mean_vol = np.mean(data, axis=-1)
+    mask = mean_vol > np.mean(mean_vol) / 8
+    table = compute_metrics(img, mask=mask)
+    assert np.allclose(table['dvars'][1:], dvars(img, mask=mask))
+    assert np.allclose(table['spm_global'],
+                       get_spm_globals(img, mask=mask))
+    assert np.allclose(table['pca_variance'], pca_variance(data, mask=mask))
+    # A mask of all True gives the unmasked values.
+    all_table = compute_metrics(img, mask=np.ones(img.shape[:-1], bool))
+    for name, values in compute_metrics(img).items():
+        assert np.allclose(all_table[name], values, equal_nan=True)
+    # The whole example image fits in the first block.
+    auto_table = compute_metrics(EXAMPLE_FILENAME, mask='auto')
+    for name, values in table.items():
+        assert np.allclose(auto_table[name], values, equal_nan=True)
+    # Otherwise the automatic mask is from the mean of the first block.
+    vol_bytes = np.prod(img.shape[:-1]) * 8
+    first_mask = mean_mask(np.mean(data[..., :3], axis=-1))
+    assert np.any(first_mask != mask)
+    auto_table = compute_metrics(EXAMPLE_FILENAME, mask='auto',
+                                 memory_budget=vol_bytes * 3)
+    first_table = compute_metrics(img, mask=first_mask)
+    for name, values in first_table.items():
+        assert np.allclose(auto_table[name], values, equal_nan=True)
+
+
+def test_compute_metrics_prefetch():
+    img = nib.load(EXAMPLE_FILENAME)
+    vol_bytes = np.prod(img.shape[:-1]) * 8
+    expected = compute_metrics(img)
+    for prefetch in (1, 4):
+        table = compute_metrics(EXAMPLE_FILENAME, memory_budget=vol_bytes * 3,
+                                prefetch=prefetch, mask='auto')
+        masked = compute_metrics(EXAMPLE_FILENAME,
+                                 memory_budget=vol_bytes * 3, mask='auto')
+        for name, values in masked.items():
+            assert np.allclose(table[name], values, equal_nan=True)
+        table = compute_metrics(img, memory_budget=vol_bytes * 3,
+                                prefetch=prefetch)
+        for name, values in expected.items():
+            assert np.allclose(table[name], values, equal_nan=True)
+
+
+def test_compute_slice_metrics():
+    img = nib.load(EXAMPLE_FILENAME)
+    data = img.get_fdata()
+    vol_bytes = np.prod(img.shape[:-1]) * 8
+    mask = np.mean(data, axis=-1) > np.mean(data) / 8
+    sq_diffs = np.diff(data, axis=-1) ** 2
+    for memory_budget in (None, vol_bytes * 4):
+        table = compute_metrics(img, ['slice_dvars', 'slice_mean', 'dvars'],
+                                memory_budget=memory_budget)
+        assert table['slice_dvars'].shape == (img.shape[2], img.shape[3])
+        assert np.all(np.isnan(table['slice_dvars'][:, 0]))
+        assert np.allclose(table['slice_dvars'][:, 1:],
+                           np.sqrt(np.mean(sq_diffs, axis=(0, 1))))
+        assert np.allclose(table['slice_mean'], np.mean(data, axis=(0, 1)))
+        # Slices have the same number of voxels, so dvars is the root mean
+        # square of the slice dvars.
+        assert np.allclose(
+            np.sqrt(np.mean(table['slice_dvars'][:, 1:] ** 2, axis=0)),
+            table['dvars'][1:])
+        # dvars from the slice sums is the same as dvars on its own.
+        assert np.allclose(table['dvars'],
+                           compute_metrics(img, ['dvars'])['dvars'],
+                           equal_nan=True)
+        table = compute_metrics(img, ['slice_dvars', 'slice_mean', 'dvars'],
+                                memory_budget=memory_budget, mask=mask)
+        with np.errstate(invalid='ignore'):
+            expected_dvars = np.sqrt(np.sum(sq_diffs * mask[..., None],
+                                            axis=(0, 1)) /
+                                     np.sum(mask, axis=(0, 1))[:, None])
+            expected_means = (np.sum(data * mask[..., None], axis=(0, 1)) /
+                              np.sum(mask, axis=(0, 1))[:, None])
+        assert np.allclose(table['slice_dvars'][:, 1:], expected_dvars,
+                           equal_nan=True)
+        assert np.allclose(table['slice_mean'], expected_means,
+                           equal_nan=True)
+        assert np.allclose(
+            table['dvars'],
+            compute_metrics(img, ['dvars'], mask=mask)['dvars'],
+            equal_nan=True)
+    # Slice metrics are not calculated by default.
+    assert 'slice_dvars' not in compute_metrics(img, memory_budget=vol_bytes)
+
+
+def test_compute_metrics_loads_once(monkeypatch):
+    from findoutlie import volumes
+    loaded = []
+    original_load_image = volumes.load_image
+
+    def counting_load_image(fname, *args, **kwargs):
+        loaded.append(fname)
+        return original_load_image(fname, *args, **kwargs)
+
+    monkeypatch.setattr(volumes, 'load_image', counting_load_image)
+    for mask in (None, 'auto'):
+        for img in (EXAMPLE_FILENAME, nib.load(EXAMPLE_FILENAME)):
+            loaded.clear()
+            compute_metrics(img, mask=mask)
+            assert len(loaded) == 1
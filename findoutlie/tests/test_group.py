@@ -0,0 +1,85 @@
+""" Test group module
+
+You can run the tests from the root directory (containing ``README.md``) with::
+
+    python3 -m pytest .
+"""
+
+import numpy as np
+
+from findoutlie.detectors import mean_std_detector
+from findoutlie.group import (run_summaries, subject_of, subject_summaries,
+                              group_outliers)
+from findoutlie.store import MetricStore
+
+
+def make_store(directory, n_subjects=12, n_runs=2, seed=0):
+    """ Make metric store with random metrics; return store and tables
+    """
+    rng = np.random.default_rng(seed)
+    store = MetricStore(directory)
+    tables = {}
+    for sub_no in range(n_subjects):
+        for run_no in range(n_runs):
+            sub = f'sub-{sub_no:02d}'
+            fname = f'data/{sub}/func/{sub}_task-test_run-{run_no:02d}.nii.gz'
+            n_vols = 20 + sub_no
+            dvars = rng.normal(10, 1, size=n_vols)
+            dvars[0] = np.nan
+            table = {'dvars': dvars,
+                     'pca_variance': rng.normal(0.5, 0.01, size=n_vols)}
+            store.append(fname, table)
+            tables[fname] = table
+    return store, tables
+
+
+def test_run_summaries(tmp_path):
+    store, tables = make_store(tmp_path, n_subjects=4)
+    names, summaries = run_summaries(store)
+    assert names == ['dvars_mean', 'dvars_max', 'pca_variance_mean',
+                     'pca_variance_max']
+    assert summaries.shape == (8, 4)
+    for row, table in zip(summaries, tables.values()):
+        assert np.allclose(row, [np.nanmean(table['dvars']),
+                                 np.nanmax(table['dvars']),
+                                 np.mean(table['pca_variance']),
+                                 np.max(table['pca_variance'])])
+    names, summaries = run_summaries(MetricStore(tmp_path / 'empty'))
+    assert names == [] and summaries.size == 0
+
+
+def test_subject_summaries():
+    assert subject_of('data/sub-07/func/sub-07_task-x_bold.nii.gz') == 'sub-07'
+    assert subject_of('data/other.nii.gz') is None
+    fnames = ['sub-02_run-01', 'sub-01_run-01', 'sub-02_run-02', 'other']
+    summaries = np.array([[1, 2], [3, 4], [5, 6], [7, 8]])
+    subjects, sub_summaries = subject_summaries(fnames, summaries)
+    assert subjects == ['sub-01', 'sub-02']
+    assert np.all(sub_summaries == [[3, 4], [3, 4]])
+
+
+def test_group_outliers(tmp_path):
+    assert group_outliers(MetricStore(tmp_path / 'empty')) == ({}, {})
+    store, tables = make_store(tmp_path / 'store')
+    # Add a bad run, and a subject with two bad runs.
+    bad_fname = 'data/sub-90/func/sub-90_run-01_bold.nii.gz'
+    store.append(bad_fname, {'dvars': np.full(20, 40.),
+                             'pca_variance': np.full(20, 0.5)})
+    bad_sub_fnames = [f'data/sub-91/func/sub-91_run-0{run_no}_bold.nii.gz'
+                      for run_no in range(2)]
+    for fname in bad_sub_fnames:
+        store.append(fname, {'dvars': np.full(20, 10.),
+                             'pca_variance': np.full(20, 0.9)})
+    run_outliers, subject_outliers = group_outliers(store)
+    assert {'dvars_mean', 'dvars_max'} <= set(run_outliers[bad_fname])
+    for fname in bad_sub_fnames:
+        assert {'pca_variance_mean', 'pca_variance_max'} <= set(
+            run_outliers[fname])
+    assert {'dvars_mean', 'dvars_max'} <= set(subject_outliers['sub-90'])
+    assert {'pca_variance_mean', 'pca_variance_max'} <= set(
+        subject_outliers['sub-91'])
+    # Most runs are not outliers.
+    assert len(run_outliers) < len(store) / 3
+    run_outliers, subject_outliers = group_outliers(
+        store, detector=mean_std_detector)
+    assert bad_fname in run_outliers
@@ -0,0 +1,81 @@
+""" Test import time of findoutlie modules and scripts
+
+Use the output of ``python -X importtime`` to check which modules a command
+imports, and the total time taken by imports.
+
+You can run the tests from the root directory (containing ``README.md``) with::
+
+    python3 -m pytest .
+"""
+
+from pathlib import Path
+import os
+import subprocess
+import sys
+
+import pytest
+
+from findoutlie.detectors import DETECTORS
+from findoutlie.metrics import PCA_METHODS
+
+ROOT_DIR = Path(__file__).parent.parent.parent
+SCRIPTS_DIR = ROOT_DIR / 'scripts'
+
+# Maximum total import time, in seconds, for quick commands.  This is well
+# above the usual time (less than 0.1 seconds), to allow for slow machines.
+STARTUP_BUDGET = 0.5
+
+# Modules that quick commands should not import at all.
+HEAVY_MODULES = {'numpy', 'nibabel', 'scipy', 'sklearn', 'pandas'}
+
+
+def import_times(args):
+    """ Run Python with `args` and ``-X importtime``
+
+    Returns
+    -------
+    times : dict
+        Dictionary with keys being names of top-level imported modules and
+        values being cumulative import time in seconds.
+    modules : set
+        Names of all imported modules.
+    """
+    env = dict(os.environ, PYTHONPATH=str(ROOT_DIR))
+    proc = subprocess.run([sys.executable, '-X', 'importtime'] + args,
+                          capture_output=True, text=True, env=env,
+                          check=True)
+    times, modules = {}, set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.add(name.strip())
+        if not name.startswith('  '):
+            times[name.strip()] = int(cumulative_us) / 1e6
+    return times, modules
+
+
+@pytest.mark.parametrize('args', [
+    ['-c', 'import findoutlie.utils'],
+    ['-c', 'import findoutlie.cache'],
+    [str(SCRIPTS_DIR / 'validate_data.py'), '--help'],
+    [str(SCRIPTS_DIR / 'find_outliers.py'), '--help'],
+    [str(SCRIPTS_DIR / 'metric_cache.py'), '--help'],
+    [str(SCRIPTS_DIR / 'group_outliers.py'), '--help'],
+])
+def test_startup(args):
+    times, modules = import_times(args)
+    assert not HEAVY_MODULES & {name.split('.')[0] for name in modules}
+    assert sum(times.values()) < STARTUP_BUDGET
+
+
+def test_detector_names():
+    sys.path.append(str(SCRIPTS_DIR))
+    try:
+        import find_outliers
+        import group_outliers
+    finally:
+        sys.path.remove(str(SCRIPTS_DIR))
+    assert set(find_outliers.DETECTOR_NAMES) == set(DETECTORS)
+    assert set(find_outliers.PCA_METHODS) == set(PCA_METHODS)
+    assert set(group_outliers.DETECTOR_NAMES) == set(DETECTORS)
@@ -0,0 +1,89 @@
+""" Test loader module
+
+You can run the tests from the root directory (containing ``README.md``) with::
+
+    python3 -m pytest .
+"""
+
+from pathlib import Path
+import gzip
+
+import numpy as np
+
+import nibabel as nib
+
+from findoutlie import loader
+from findoutlie.loader import load_image, SCRATCH_ENV_VAR
+
+MY_DIR = Path(__file__).parent
+EXAMPLE_FILENAME = MY_DIR / 'ds107_sub012_t1r2_small.nii'
+
+
+def test_load_image(tmp_path, monkeypatch):
+    img = nib.load(EXAMPLE_FILENAME)
+    data = img.get_fdata()
+    gz_fname = tmp_path / 'example.nii.gz'
+    nib.save(img, str(gz_fname))
+    nib.save(nib.Nifti2Image(data, img.affine), str(tmp_path / 'ni2.nii.gz'))
+    # Use the standard library gzip module as a fast module, so the tests
+    # cover the code for fast modules, even when none is installed.
+    monkeypatch.setattr(loader, 'HAVE_INDEXED_GZIP', False)
+    for fast_gzip in (loader.fast_gzip or gzip, None):
+        monkeypatch.setattr(loader, 'fast_gzip', fast_gzip)
+        loaded = load_image(gz_fname)
+        assert isinstance(loaded.file_map['image'].fileobj,
+                          loader._ReopeningGzipFile) == (fast_gzip is not None)
+        for fname in (EXAMPLE_FILENAME, gz_fname):
+            loaded = load_image(fname)
+            assert np.all(loaded.dataobj[..., 2:5] == data[..., 2:5])
+            assert np.all(loaded.get_fdata() == data)
+        loaded = load_image(tmp_path / 'ni2.nii.gz')
+        assert isinstance(loaded, nib.Nifti2Image)
+        assert np.all(loaded.get_fdata() == data)
+
+
+def test_reopening_gzip_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(loader, 'fast_gzip', loader.fast_gzip or gzip)
+    fname = tmp_path / 'data.gz'
+    contents = bytes(range(256)) * 10
+    with gzip.open(fname, 'wb') as fobj:
+        fobj.write(contents)
+    with loader._ReopeningGzipFile(fname) as fobj:
+        assert fobj.read(100) == contents[:100]
+        # Seeking backwards reopens the file.
+        first_file = fobj._fobj
+        fobj.seek(10)
+        assert fobj._fobj is not first_file
+        assert fobj.read(10) == contents[10:20]
+        fobj.seek(-5, 1)
+        assert fobj.tell() == 15
+        assert fobj.read(5) == contents[15:20]
+        # Seeking forwards does not.
+        second_file = fobj._fobj
+        fobj.seek(1000)
+        assert fobj._fobj is second_file
+        assert fobj.read() == contents[1000:]
+    assert second_file.closed
+
+
+def test_load_image_scratch(tmp_path, monkeypatch):
+    img = nib.load(EXAMPLE_FILENAME)
+    gz_fname = tmp_path / 'example.nii.gz'
+    nib.save(img, str(gz_fname))
+    scratch_dir = tmp_path / 'scratch'
+    loaded = load_image(gz_fname, scratch_dir=scratch_dir)
+    scratch_files = list(scratch_dir.glob('*.nii'))
+    assert len(scratch_files) == 1
+    assert loaded.get_filename() == str(scratch_files[0])
+    assert np.all(loaded.get_fdata() == img.get_fdata())
+    # Second load uses the same copy.
+    load_image(gz_fname, scratch_dir=scratch_dir)
+    assert list(scratch_dir.glob('*')) == scratch_files
+    # Scratch directory from environment.
+    other_dir = tmp_path / 'other'
+    monkeypatch.setenv(SCRATCH_ENV_VAR, str(other_dir))
+    load_image(gz_fname)
+    assert len(list(other_dir.glob('*.nii'))) == 1
+    # Uncompressed files are not copied.
+    assert load_image(EXAMPLE_FILENAME).get_filename() == str(
+        EXAMPLE_FILENAME)
@@ -0,0 +1,78 @@
+""" Test masks module
+
+You can run the tests from the root directory (containing ``README.md``) with::
+
+    python3 -m pytest .
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+import nibabel as nib
+
+from findoutlie.masks import (mean_image, compute_mask, mean_mask,
+                              masked_voxels, slice_mask)
+from findoutlie.metrics import pca_variance
+from findoutlie.spm_funcs import spm_globals
+
+MY_DIR = Path(__file__).parent
+EXAMPLE_FILENAME = MY_DIR / 'ds107_sub012_t1r2_small.nii'
+
+
+def test_compute_mask():
+    img = nib.load(EXAMPLE_FILENAME)
+    data = img.get_fdata()
+    mean_vol = np.mean(data, axis=-1)
+    vol_bytes = np.prod(img.shape[:-1]) * 8
+    for memory_budget in (None, vol_bytes * 4):
+        assert np.allclose(mean_image(img, memory_budget=memory_budget),
+                           mean_vol)
+        mask = compute_mask(EXAMPLE_FILENAME, memory_budget=memory_budget)
+        assert mask.dtype == bool
+        assert np.all(mask == (mean_vol > np.mean(mean_vol) / 8))
+        assert np.all(mask == mean_mask(mean_vol))
+    # The example image has plenty of background.
+    assert 0 < np.count_nonzero(mask) < mask.size
+
+
+def test_masked_metrics():
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(9, 8, 7, 12))
+    mask = np.zeros(data.shape[:-1], dtype=bool)
+    mask[2:7, 1:6, 1:6] = True
+    # Values outside the mask must have no effect.
+    noisy = data.copy()
+    noisy[~mask] = 100 * rng.normal(size=(np.count_nonzero(~mask), 12))
+    assert np.allclose(spm_globals(noisy, mask=mask),
+                       spm_globals(data, mask=mask))
+    assert np.allclose(spm_globals(data, mask=mask),
+                       spm_globals(data[2:7, 1:6, 1:6]))
+    plane_mask = slice_mask(mask)
+    assert plane_mask.shape == (9, 8)
+    assert np.all(plane_mask == np.any(mask, axis=-1))
+    plane_noisy = data.copy()
+    plane_noisy[~plane_mask] = 100
+    assert np.allclose(pca_variance(plane_noisy, mask=mask),
+                       pca_variance(data, mask=mask))
+    assert np.allclose(pca_variance(data, mask=mask),
+                       pca_variance(data[2:7, 1:6]))
+
+
+def test_masked_voxels():
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(9, 8, 7, 12))
+    mask = rng.uniform(size=data.shape[:-1]) > 0.5
+    plane_mask = slice_mask(mask)
+    for arr in (data, np.asfortranarray(data), data[:, ::2]):
+        arr_mask = mask[:, :arr.shape[1]]
+        arr_plane_mask = plane_mask[:, :arr.shape[1]]
+        masked = masked_voxels(arr, arr_mask)
+        assert np.all(masked == arr[arr_mask])
+        plane_data = masked_voxels(arr, arr_plane_mask)
+        assert np.all(plane_data == arr[arr_plane_mask])
+        # Voxels in the mask from the in-plane positions in the mask.
+        assert np.all(masked_voxels(plane_data, arr_mask[arr_plane_mask]) ==
+                      masked)
+    # Blocks from iter_volume_blocks are Fortran ordered; so is the result.
+    assert masked_voxels(np.asfortranarray(data), mask).flags.f_contiguous
@@ -0,0 +1,108 @@
+""" Test metrics module
+
+You can run the tests from the root directory (containing ``README.md``) with::
+
+    python3 -m pytest .
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+import nibabel as nib
+
+import pytest
+
+from findoutlie.metrics import (dvars, pca_variance, leading_eigenvalues,
+                                DvarsAccumulator, PcaVarianceAccumulator)
+
+MY_DIR = Path(__file__).parent
+EXAMPLE_FILENAME = MY_DIR / 'ds107_sub012_t1r2_small.nii'
+
+
+def test_dvars_blocks():
+    img = nib.load(EXAMPLE_FILENAME)
+    data = img.get_fdata()
+    diffs = np.diff(np.reshape(data, (-1, data.shape[-1])), axis=1)
+    expected = np.sqrt(np.mean(diffs ** 2, axis=0))
+    vol_bytes = np.prod(img.shape[:-1]) * 8
+    # Block boundaries must not change the values.
+    for memory_budget in (None, vol_bytes, vol_bytes * 4):
+        assert np.allclose(dvars(img, memory_budget=memory_budget), expected)
+    assert np.allclose(dvars(EXAMPLE_FILENAME), expected)
+
+
+def test_dvars_dtype_mask():
+    img = nib.load(EXAMPLE_FILENAME)
+    data = img.get_fdata()
+    diffs = np.diff(np.reshape(data, (-1, data.shape[-1])), axis=1)
+    expected = np.sqrt(np.mean(diffs ** 2, axis=0))
+    assert np.allclose(dvars(img, dtype=np.float32), expected, rtol=1e-5)
+    mask = np.mean(data, axis=-1) > np.mean(data) / 8
+    masked_diffs = np.diff(data[mask], axis=1)
+    masked_expected = np.sqrt(np.mean(masked_diffs ** 2, axis=0))
+    vol_bytes = np.prod(img.shape[:-1]) * 8
+    for memory_budget in (None, vol_bytes * 3):
+        assert np.allclose(dvars(img, memory_budget=memory_budget, mask=mask),
+                           masked_expected)
+
+
+def test_pca_variance():
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(9, 8, 7, 12))
+    data[..., 2, 4] += 10 * rng.normal(size=(9, 8))
+    pca_vals = pca_variance(data)
+    assert pca_vals.shape == (12,)
+    # Calculate the values the long way round, with SVD for each volume.
+    for vol_no in range(data.shape[-1]):
+        vol = np.reshape(data[..., vol_no], (-1, data.shape[-2]))
+        vol = vol - vol.mean(axis=0)
+        sing_vals = np.linalg.svd(vol, compute_uv=False)
+        expected = sing_vals[0] ** 2 / np.sum(sing_vals ** 2)
+        assert np.allclose(pca_vals[vol_no], expected)
+    assert np.argmax(pca_vals) == 4
+
+
+def test_leading_eigenvalues():
+    rng = np.random.default_rng(0)
+    arrs = rng.normal(size=(20, 40, 6))
+    arrs[:10, :, 0] *= 10
+    matrices = np.swapaxes(arrs, 1, 2) @ arrs
+    expected = np.linalg.eigvalsh(matrices)[:, -1]
+    eigvals = leading_eigenvalues(matrices)
+    assert np.allclose(eigvals, expected)
+    assert np.all(eigvals == leading_eigenvalues(matrices))
+    # Without convergence, fall back to eigvalsh.
+    assert np.allclose(leading_eigenvalues(matrices, max_iter=1), expected)
+    assert np.all(leading_eigenvalues(np.zeros((2, 3, 3))) == 0)
+
+
+def test_pca_variance_power():
+    img = nib.load(EXAMPLE_FILENAME)
+    data = img.get_fdata()
+    assert np.allclose(pca_variance(data, method='power'), pca_variance(data))
+    mask = np.mean(data, axis=-1) > np.mean(data) / 8
+    assert np.allclose(pca_variance(data, mask, method='power'),
+                       pca_variance(data, mask))
+    with pytest.raises(ValueError):
+        pca_variance(data, method='svd')
+    # The accumulator passes the power iteration options on.
+    accumulator = PcaVarianceAccumulator(method='power', tol=1e-3, seed=1)
+    accumulator.update(data)
+    assert np.all(accumulator.result() ==
+                  pca_variance(data, method='power', tol=1e-3, seed=1))
+    # The looser tolerance gives less precise values.
+    assert not np.allclose(accumulator.result(), pca_variance(data))
+    assert np.allclose(accumulator.result(), pca_variance(data), rtol=1e-4)
+
+
+def test_dvars_pop_values():
+    data = nib.load(EXAMPLE_FILENAME).get_fdata()
+    accumulator = DvarsAccumulator()
+    values = []
+    for start in range(0, data.shape[-1], 3):
+        accumulator.update(data[..., start:start + 3])
+        values.append(accumulator.pop_values())
+    assert len(values[0]) == 2 and len(values[1]) == 3
+    assert np.allclose(np.concatenate(values), dvars(EXAMPLE_FILENAME))
+    assert len(accumulator.result()) == 0
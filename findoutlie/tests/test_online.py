@@ -0,0 +1,88 @@
+""" Test online module
+
+You can run the tests from the root directory (containing ``README.md``) with::
+
+    python3 -m pytest .
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+import nibabel as nib
+
+from findoutlie.engine import compute_metrics
+from findoutlie.online import (RunningStats, OnlineDetector,
+                               iter_online_outliers)
+
+MY_DIR = Path(__file__).parent
+EXAMPLE_FILENAME = MY_DIR / 'ds107_sub012_t1r2_small.nii'
+
+
+def test_running_stats():
+    stats = RunningStats()
+    assert np.isnan(stats.var)
+    values = np.random.default_rng(0).normal(1000, 2, size=100)
+    for value in values:
+        stats.update(value)
+    assert stats.count == 100
+    assert np.isclose(stats.mean, np.mean(values))
+    assert np.isclose(stats.var, np.var(values))
+    assert np.isclose(stats.std, np.std(values))
+
+
+def test_replay():
+    img = nib.load(EXAMPLE_FILENAME)
+    table = compute_metrics(img)
+    n_vols = img.shape[-1]
+    detector = OnlineDetector(min_volumes=5)
+    flags = [detector.add_volume(img.dataobj[..., i]) for i in range(n_vols)]
+    # Running statistics match statistics of whole run.
+    for name, stats in detector.stats.items():
+        values = table[name][~np.isnan(table[name])]
+        assert stats.count == len(values)
+        assert np.isclose(stats.mean, np.mean(values))
+        assert np.isclose(stats.std, np.std(values))
+    # Flags compare each value to the values before it.
+    expected_outliers = []
+    for vol_no in range(n_vols):
+        vol_flags = {}
+        for name, values in table.items():
+            earlier = values[:vol_no][~np.isnan(values[:vol_no])]
+            if np.isnan(values[vol_no]):
+                continue
+            vol_flags[name] = bool(
+                len(earlier) >= 5 and
+                values[vol_no] > np.mean(earlier) + 2 * np.std(earlier))
+        assert flags[vol_no] == vol_flags
+        if any(vol_flags.values()):
+            expected_outliers.append(vol_no)
+    assert detector.outliers == expected_outliers
+    assert len(expected_outliers) > 0
+    replayed = list(iter_online_outliers(EXAMPLE_FILENAME, min_volumes=5))
+    assert replayed == list(enumerate(flags))
+
+
+def test_spike():
+    rng = np.random.default_rng(1)
+    detector = OnlineDetector(min_volumes=10)
+    for vol_no in range(30):
+        vol = rng.normal(100, 1, size=(6, 5, 4))
+        if vol_no == 20:
+            vol[..., 2] += 50
+        detector.add_volume(vol)
+    assert 20 in detector.outliers
+    mask = np.ones((6, 5, 4), dtype=bool)
+    mask[0] = False
+    detector = OnlineDetector(mask=mask)
+    vol = rng.normal(100, 1, size=(6, 5, 4))
+    detector.add_volume(vol)
+    vol = vol.copy()
+    vol[0] = 1000
+    assert detector.metrics_for(vol)['dvars'] == 0
+    # Constant volumes have NaN PCA variance, which is left out.
+    detector = OnlineDetector(min_volumes=0)
+    with np.errstate(invalid='ignore'):
+        flags = detector.add_volume(np.ones((6, 5, 4)))
+    assert not flags['pca_variance']
+    assert detector.stats['pca_variance'].count == 0
@@ -0,0 +1,227 @@
+""" Test outfind module
+
+You can run the tests from the root directory (containing ``README.md``) with::
+
+    python3 -m pytest .
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+import os
+
+import numpy as np
+
+import nibabel as nib
+
+import pytest
+
+from findoutlie.cache import MetricCache
+from findoutlie.detectors import iqr_detector
+from findoutlie import outfind
+from findoutlie.outfind import (detect_outliers, detect_slice_outliers,
+                                find_outliers, iter_outliers, shard_fnames)
+from findoutlie.store import MetricStore
+from findoutlie.utils import file_hash
+
+
+def make_run(fname, shape=(8, 7, 6, 30), spikes=(5, 17), seed=0):
+    """ Save random 4D image to `fname` with large slice-wise spikes
+    """
+    rng = np.random.default_rng(seed)
+    data = rng.normal(100, 5, size=shape)
+    for vol_no in spikes:
+        # Large signal in one slice dominates the first principal component.
+        data[..., 0, vol_no] += 400 * rng.normal(size=shape[:2])
+    nib.save(nib.Nifti1Image(data.astype(np.float32), np.eye(4)), str(fname))
+    return data
+
+
+def make_data_directory(root):
+    """ Make data directory with two good runs and one unreadable run
+    """
+    for sub_no, spikes in ((1, (5, 17)), (2, (3,))):
+        func_dir = root / f'sub-0{sub_no}' / 'func'
+        func_dir.mkdir(parents=True)
+        make_run(func_dir / f'sub-0{sub_no}_task-test_run-01_bold.nii.gz',
+                 spikes=spikes, seed=sub_no)
+    bad_fname = (root / 'sub-03' / 'func' /
+                 'sub-03_task-test_run-01_bold.nii.gz')
+    bad_fname.parent.mkdir(parents=True)
+    bad_fname.write_bytes(b'not an image')
+
+
+def test_detect_outliers(tmp_path):
+    fname = tmp_path / 'sub-01_bold.nii.gz'
+    make_run(fname)
+    assert list(detect_outliers(fname)) == [5, 17]
+    assert list(detect_outliers(fname, detector=iqr_detector)) == [5, 17]
+
+
+def test_find_outliers_jobs(tmp_path):
+    make_data_directory(tmp_path)
+    serial = find_outliers(tmp_path)
+    parallel = find_outliers(tmp_path, n_jobs=2)
+    assert list(serial) == list(parallel) == sorted(serial)
+    assert len(serial) == 3
+    fnames = list(serial)
+    for fname in fnames[:2]:
+        assert list(serial[fname]) == list(parallel[fname])
+    assert list(serial[fnames[0]]) == [5, 17]
+    assert list(serial[fnames[1]]) == [3]
+    # The unreadable file gives an error, without stopping the other files.
+    assert isinstance(serial[fnames[2]], Exception)
+    assert isinstance(parallel[fnames[2]], Exception)
+
+
+def test_find_outliers_cache(tmp_path, monkeypatch):
+    data_dir = tmp_path / 'data'
+    make_data_directory(data_dir)
+    cache = MetricCache(tmp_path / 'cache')
+    expected = find_outliers(data_dir)
+    outlier_dict = find_outliers(data_dir, cache=cache)
+    assert len(cache.entries()) == 2
+    fnames = list(outlier_dict)
+    for fname in fnames[:2]:
+        assert list(outlier_dict[fname]) == list(expected[fname])
+        table = cache.get(file_hash(fname))
+        assert set(table) == {'dvars', 'spm_global', 'pca_variance'}
+    # Second run uses the cache, without calculating any metrics.
+    def no_compute(*args, **kwargs):
+        raise RuntimeError('Should use cache')
+
+    monkeypatch.setattr(outfind, 'compute_metrics', no_compute)
+    outlier_dict = find_outliers(data_dir, detector=iqr_detector,
+                                 cache=cache)
+    assert list(outlier_dict[fnames[0]]) == [5, 17]
+    assert isinstance(outlier_dict[fnames[2]], Exception)
+    # Metrics from the power method are cached separately.
+    monkeypatch.undo()
+    outlier_dict = find_outliers(data_dir, cache=cache, pca_method='power')
+    assert list(outlier_dict[fnames[0]]) == [5, 17]
+    assert len(cache.entries()) == 4
+    assert cache.get(file_hash(fnames[0]), 'power') is not None
+
+
+def test_find_outliers_store(tmp_path):
+    data_dir = tmp_path / 'data'
+    make_data_directory(data_dir)
+    store = MetricStore(tmp_path / 'store')
+    outlier_dict = find_outliers(data_dir, n_jobs=2, store=store)
+    fnames = list(outlier_dict)
+    # The unreadable file is not in the store.
+    assert [run['fname'] for run in store.runs] == fnames[:2]
+    assert store.metrics == ['dvars', 'pca_variance', 'spm_global']
+    assert list(store.offsets()) == [0, 30, 60]
+    pca_vals = store.run(fnames[0])['pca_variance']
+    assert list(np.flatnonzero(pca_vals > pca_vals.mean() +
+                               2 * pca_vals.std())) == [5, 17]
+    # Running again does not add the same runs again.
+    find_outliers(data_dir, store=store)
+    assert len(MetricStore(tmp_path / 'store')) == 2
+
+
+def test_iter_outliers(tmp_path):
+    make_data_directory(tmp_path)
+    expected = find_outliers(tmp_path)
+    fnames = list(expected)
+    for n_jobs in (1, 2):
+        iterator = iter_outliers(tmp_path, n_jobs=n_jobs)
+        fname, outliers = next(iterator)
+        assert fname == fnames[0]
+        assert list(outliers) == [5, 17]
+        # Stopping early is fine.
+        iterator.close()
+        results = list(iter_outliers(tmp_path, n_jobs=n_jobs,
+                                     skip={fnames[0]}))
+        assert [fname for fname, outliers in results] == fnames[1:]
+        results = list(iter_outliers(tmp_path, n_jobs=n_jobs, prefetch=2))
+        assert [fname for fname, outliers in results] == fnames
+        assert list(results[0][1]) == [5, 17]
+
+
+def _double_or_die(value):
+    # Kill the worker process, as the system does when it runs out of memory.
+    if value == 3:
+        os._exit(1)
+    return value * 2
+
+
+_analyse_or_error = outfind._analyse_or_error
+
+
+def _analyse_or_die(fname, *args, **kwargs):
+    if 'sub-02' in str(fname):
+        os._exit(1)
+    return _analyse_or_error(fname, *args, **kwargs)
+
+
+def test_ordered_map_broken_pool():
+    make_executor = partial(ProcessPoolExecutor, max_workers=2)
+    for window in (1, 4):
+        results = list(outfind._ordered_map(make_executor, _double_or_die,
+                                            range(8), window=window))
+        assert isinstance(results[3], BrokenProcessPool)
+        assert results[:3] + results[4:] == [0, 2, 4, 8, 10, 12, 14]
+
+
+def test_iter_outliers_dead_worker(tmp_path, monkeypatch):
+    make_data_directory(tmp_path)
+    expected = find_outliers(tmp_path)
+    monkeypatch.setattr(outfind, '_analyse_or_error', _analyse_or_die)
+    results = dict(iter_outliers(tmp_path, n_jobs=2))
+    assert list(results) == list(expected)
+    fnames = list(results)
+    assert list(results[fnames[0]]) == list(expected[fnames[0]])
+    # A dead worker is an error for that image only.
+    assert isinstance(results[fnames[1]], BrokenProcessPool)
+    assert isinstance(results[fnames[2]], Exception)
+
+
+def test_shard_fnames(tmp_path):
+    sizes = [50, 10, 40, 30, 30, 20, 5]
+    fnames = []
+    for i, size in enumerate(sizes):
+        fname = tmp_path / f'file{i}.bin'
+        fname.write_bytes(b'x' * size)
+        fnames.append(str(fname))
+    for n_shards in (1, 2, 3, 8):
+        shards = [shard_fnames(fnames, i, n_shards) for i in range(n_shards)]
+        # Each file is in exactly one shard.
+        assert sorted(sum(shards, [])) == sorted(fnames)
+        assert shards == [shard_fnames(fnames[::-1], i, n_shards)
+                          for i in range(n_shards)]
+    totals = [sum(sizes[fnames.index(fname)] for fname in shard)
+              for shard in (shard_fnames(fnames, i, 2) for i in range(2))]
+    assert totals == [95, 90]
+    with pytest.raises(ValueError):
+        shard_fnames(fnames, 2, 2)
+
+
+def test_iter_outliers_shard(tmp_path):
+    make_data_directory(tmp_path)
+    expected = find_outliers(tmp_path)
+    results = {}
+    for shard in range(2):
+        shard_results = dict(iter_outliers(tmp_path, shard=(shard, 2)))
+        assert len(shard_results) in (1, 2)
+        results.update(shard_results)
+    assert list(sorted(results)) == list(expected)
+    for fname, outliers in expected.items():
+        if not isinstance(outliers, Exception):
+            assert list(results[fname]) == list(outliers)
+
+
+def test_detect_slice_outliers(tmp_path):
+    fname = tmp_path / 'sub-01_bold.nii.gz'
+    make_run(fname, spikes=(5, 17))
+    slice_outliers = detect_slice_outliers(fname)
+    assert slice_outliers.shape[1] == 2
+    pairs = {tuple(pair) for pair in slice_outliers.tolist()}
+    # Spikes in slice 0 change the DVARS into, and out of, the spike volumes.
+    assert {(0, 5), (0, 6), (0, 17), (0, 18)} <= pairs
+    # Sorted by volume, then slice.
+    assert np.all(np.diff(slice_outliers[:, 1]) >= 0)
+    vol_bytes = 8 * 7 * 6 * 8
+    assert np.all(detect_slice_outliers(fname, memory_budget=vol_bytes * 4)
+                  == slice_outliers)
@@ -0,0 +1,70 @@
+""" Test prefetch module
+
+You can run the tests from the root directory (containing ``README.md``) with::
+
+    python3 -m pytest .
+"""
+
+import threading
+import time
+
+import pytest
+
+from findoutlie import profiling
+from findoutlie.prefetch import prefetch
+
+
+def test_prefetch():
+    for depth in (0, 1, 3):
+        assert list(prefetch(range(10), depth)) == list(range(10))
+    assert list(prefetch([], 2)) == []
+
+
+def test_prefetch_bounded():
+    produced = []
+
+    def items():
+        for i in range(20):
+            produced.append(i)
+            yield i
+
+    iterator = prefetch(items(), 3)
+    for i in range(5):
+        assert next(iterator) == i
+        time.sleep(0.05)
+        # The queue, and the item being made.
+        assert len(produced) <= i + 1 + 3 + 1
+    n_threads = threading.active_count()
+    iterator.close()
+    assert threading.active_count() == n_threads - 1
+    assert len(produced) < 20
+
+
+def test_prefetch_error():
+
+    def items():
+        yield 1
+        yield 2
+        raise RuntimeError('Read failed')
+
+    iterator = prefetch(items(), 2)
+    assert next(iterator) == 1
+    assert next(iterator) == 2
+    with pytest.raises(RuntimeError):
+        next(iterator)
+
+
+def test_prefetch_profile():
+
+    def items():
+        for i in range(3):
+            with profiling.stage('read', 10):
+                yield i
+
+    profiling.enable()
+    try:
+        with profiling.file_profile('a_file') as file_prof:
+            assert list(prefetch(items(), 2)) == [0, 1, 2]
+    finally:
+        profiling.enable(False)
+    assert file_prof.stages['read']['calls'] == 3
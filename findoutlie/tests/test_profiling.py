@@ -0,0 +1,65 @@
+""" Test profiling module
+
+You can run the tests from the root directory (containing ``README.md``) with::
+
+    python3 -m pytest .
+"""
+
+from pathlib import Path
+
+from findoutlie import profiling
+from findoutlie.outfind import iter_outliers
+from findoutlie.utils import validate_data
+
+from .test_outfind import make_data_directory
+
+
+def test_stage():
+    assert not profiling.is_enabled()
+    with profiling.file_profile('a_file') as file_prof:
+        with profiling.stage('read', 10):
+            pass
+    assert file_prof is None
+    profiling.enable()
+    try:
+        with profiling.stage('read', 10):
+            pass
+        with profiling.file_profile('a_file') as file_prof:
+            for i in range(3):
+                with profiling.stage('read', 10):
+                    pass
+            with profiling.stage('detect'):
+                pass
+    finally:
+        profiling.enable(False)
+    summary = file_prof.summary()
+    assert summary['fname'] == 'a_file'
+    assert summary['total_time'] > 0
+    assert summary['stages']['read']['calls'] == 3
+    assert summary['stages']['read']['bytes'] == 30
+    assert summary['stages']['detect']['calls'] == 1
+
+
+def test_iter_outliers_profile(tmp_path):
+    make_data_directory(tmp_path)
+    for n_jobs in (1, 2):
+        summaries = []
+        results = list(iter_outliers(tmp_path, n_jobs=n_jobs,
+                                     profile_callback=summaries.append))
+        assert ([summary['fname'] for summary in summaries] ==
+                [fname for fname, outliers in results])
+        stages = summaries[0]['stages']
+        assert set(stages) == {'load', 'read', 'metric:pca_variance',
+                               'detect'}
+        assert stages['read']['bytes'] == 8 * 7 * 6 * 30 * 8
+        assert not profiling.is_enabled()
+
+
+def test_validate_data_profile():
+    data_directory = Path(__file__).parent / 'test_files'
+    summaries = []
+    validate_data(data_directory, use_cache=False,
+                  profile_callback=summaries.append)
+    assert len(summaries) == 2
+    assert all(summary['stages']['hash']['calls'] == 1
+               for summary in summaries)
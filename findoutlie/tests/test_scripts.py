@@ -0,0 +1,118 @@
+""" Test scripts in the ``scripts`` directory
+
+You can run the tests from the root directory (containing ``README.md``) with::
+
+    python3 -m pytest .
+"""
+
+from pathlib import Path
+import json
+import subprocess
+import sys
+
+from findoutlie.store import MetricStore
+
+from .test_outfind import make_data_directory, make_run
+
+SCRIPTS_DIR = Path(__file__).parent.parent.parent / 'scripts'
+
+
+def run_script(name, *args):
+    return subprocess.run([sys.executable, str(SCRIPTS_DIR / name)] +
+                          [str(arg) for arg in args],
+                          capture_output=True, text=True, check=True)
+
+
+def test_find_outliers_output_resume(tmp_path):
+    data_dir = tmp_path / 'data'
+    make_data_directory(data_dir)
+    output = tmp_path / 'outliers.jsonl'
+    result = run_script('find_outliers.py', data_dir, '--output', output)
+    lines = output.read_text().splitlines()
+    records = [json.loads(line) for line in lines]
+    assert len(records) == 3
+    assert records[0]['outliers'] == [5, 17]
+    assert records[1]['outliers'] == [3]
+    assert 'error' in records[2]
+    assert result.stdout.splitlines()[0] == f"{records[0]['fname']}, 5, 17"
+    # Simulate run killed while writing second line.
+    output.write_text(lines[0] + '\n' + lines[1][:10])
+    result = run_script('find_outliers.py', data_dir, '--output', output)
+    assert output.read_text().splitlines() == lines
+    # Only the missing images were analysed.
+    assert records[0]['fname'] not in result.stdout
+    # Images with errors are tried again.
+    bad_fname = Path(records[2]['fname'])
+    make_run(bad_fname, spikes=(7,))
+    run_script('find_outliers.py', data_dir, '--output', output)
+    new_lines = output.read_text().splitlines()
+    assert new_lines[:3] == lines
+    assert json.loads(new_lines[3]) == {'fname': str(bad_fname),
+                                        'outliers': [7]}
+    result = run_script('find_outliers.py', data_dir, '--output', output)
+    assert output.read_text().splitlines() == new_lines
+    # Merging keeps the later result.
+    merged = tmp_path / 'merged.jsonl'
+    run_script('find_outliers.py', 'merge', output, '--output', merged)
+    assert [json.loads(line) for line in merged.read_text().splitlines()] == (
+        records[:2] + [json.loads(new_lines[3])])
+
+
+def test_find_outliers_shards(tmp_path):
+    data_dir = tmp_path / 'data'
+    make_data_directory(data_dir)
+    expected = run_script('find_outliers.py', data_dir)
+    power = run_script('find_outliers.py', data_dir, '--pca-method', 'power')
+    assert power.stdout == expected.stdout
+    n_shards = 2
+    fragments = [tmp_path / f'part{i}.jsonl' for i in range(n_shards)]
+    store_dir = tmp_path / 'store'
+    # Run shards at the same time, as for a cluster job array.
+    procs = [subprocess.Popen([sys.executable,
+                               str(SCRIPTS_DIR / 'find_outliers.py'),
+                               str(data_dir), '--shard', f'{i}/{n_shards}',
+                               '--output', str(fragment),
+                               '--store', str(store_dir)],
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+             for i, fragment in enumerate(fragments)]
+    assert [proc.wait() for proc in procs] == [0] * n_shards
+    fragment_fnames = [{json.loads(line)['fname']
+                        for line in fragment.read_text().splitlines()}
+                       for fragment in fragments]
+    assert all(fragment_fnames)
+    assert not fragment_fnames[0] & fragment_fnames[1]
+    output = tmp_path / 'merged.jsonl'
+    merged = run_script('find_outliers.py', 'merge', *fragments,
+                        '--output', output, '--store', store_dir)
+    assert merged.stdout == expected.stdout
+    assert merged.stderr.splitlines() == [
+        line for line in expected.stderr.splitlines() if ': error: ' in line]
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert len(records) == 3
+    assert records[0]['outliers'] == [5, 17]
+    # Each shard has its own store, and merge combines them.
+    shard_stores = [MetricStore(store_dir / f'shard-{i}-of-{n_shards}')
+                    for i in range(n_shards)]
+    assert all(len(shard_store) for shard_store in shard_stores)
+    store = MetricStore(store_dir)
+    assert sorted(run['fname'] for run in store.runs) == [
+        record['fname'] for record in records if 'error' not in record]
+    # Bad shards are command line errors.
+    proc = subprocess.run([sys.executable,
+                           str(SCRIPTS_DIR / 'find_outliers.py'),
+                           str(data_dir), '--shard', '2/2'],
+                          capture_output=True, text=True)
+    assert proc.returncode == 2
+
+
+def test_group_outliers(tmp_path):
+    data_dir = tmp_path / 'data'
+    make_data_directory(data_dir)
+    store_dir = tmp_path / 'store'
+    run_script('find_outliers.py', data_dir, '--store', store_dir)
+    result = run_script('group_outliers.py', store_dir)
+    # Two runs are too few for any outliers.
+    assert result.stdout == ''
+    result = run_script('group_outliers.py', store_dir, '--detector', 'mad')
+    assert result.returncode == 0
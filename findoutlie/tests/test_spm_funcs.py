@@ -17,6 +17,8 @@ EXAMPLE_FILENAME = 'ds107_sub012_t1r2_small.nii'
 
 CODE_DIR = (MY_DIR / '..').absolute()
 sys.path.append(str(CODE_DIR))
+# get_spm_globals uses the findoutlie package.
+sys.path.append(str(CODE_DIR / '..'))
 
 import numpy as np
 
@@ -24,7 +26,7 @@ import nibabel as nib
 
 # This import needs the directory containing the findoutlie directory
 # on the Python path.
-from spm_funcs import get_spm_globals, spm_global
+from spm_funcs import get_spm_globals, spm_global, spm_globals
 
 
 def test_spm_globals():
@@ -43,7 +45,25 @@ def test_spm_globals():
     assert np.allclose(globals, expected_values, rtol=1e-4)
 
 
+def test_spm_globals_vectorized():
+    # Test batched spm_globals against reference values
+    example_path = MY_DIR / EXAMPLE_FILENAME
+    expected_values = np.loadtxt(MY_DIR / 'global_signals.txt')
+    glob_vals = get_spm_globals(example_path)
+    assert isinstance(glob_vals, np.ndarray)
+    data = nib.load(example_path).get_fdata()
+    assert np.allclose(spm_globals(data), expected_values, rtol=1e-4)
+    # C ordered copy gives the same answer.
+    assert np.allclose(spm_globals(np.ascontiguousarray(data)),
+                       expected_values, rtol=1e-4)
+    glob_vals_32 = get_spm_globals(example_path, dtype=np.float32)
+    assert np.allclose(glob_vals_32, expected_values, rtol=1e-4)
+    assert np.allclose(spm_globals(data, dtype=np.float32),
+                       expected_values, rtol=1e-4)
+
+
 if __name__ == '__main__':
     # File being executed as a script
     test_spm_globals()
+    test_spm_globals_vectorized()
     print('Tests passed')
@@ -0,0 +1,67 @@
+""" Test store module
+
+You can run the tests from the root directory (containing ``README.md``) with::
+
+    python3 -m pytest .
+"""
+
+import numpy as np
+
+import pytest
+
+from findoutlie.store import MetricStore
+
+
+def test_metric_store(tmp_path):
+    store = MetricStore(tmp_path / 'store')
+    assert len(store) == 0
+    assert store.column('dvars').shape == (0,)
+    rng = np.random.default_rng(0)
+    tables = {}
+    for fname, n_vols in (('run1.nii.gz', 5), ('run2.nii.gz', 3),
+                          ('run3.nii.gz', 4)):
+        tables[fname] = {'dvars': rng.normal(size=n_vols),
+                         'spm_global': rng.normal(size=n_vols)}
+        store.append(fname, tables[fname])
+    assert store.metrics == ['dvars', 'spm_global']
+    assert list(store.offsets()) == [0, 5, 8, 12]
+    # Read back from a new store object.
+    store = MetricStore(tmp_path / 'store')
+    assert len(store) == 3
+    assert 'run2.nii.gz' in store
+    column = store.column('dvars')
+    assert isinstance(column, np.memmap)
+    assert np.all(column == np.concatenate(
+        [table['dvars'] for table in tables.values()]))
+    run2 = store.run('run2.nii.gz')
+    assert np.all(run2['spm_global'] == tables['run2.nii.gz']['spm_global'])
+    with pytest.raises(KeyError):
+        store.run('run4.nii.gz')
+    with pytest.raises(ValueError):
+        store.append('run2.nii.gz', tables['run2.nii.gz'])
+    with pytest.raises(ValueError):
+        store.append('run4.nii.gz', {'dvars': np.zeros(2)})
+    with pytest.raises(ValueError):
+        store.append('run4.nii.gz', {'dvars': np.zeros(2),
+                                     'spm_global': np.zeros(3)})
+    assert len(store) == 3
+
+
+def test_metric_store_extend(tmp_path):
+    rng = np.random.default_rng(0)
+    tables = {fname: {'dvars': rng.normal(size=n_vols)}
+              for fname, n_vols in (('run1.nii.gz', 5), ('run2.nii.gz', 3),
+                                    ('run3.nii.gz', 4))}
+    part0 = MetricStore(tmp_path / 'part0')
+    part1 = MetricStore(tmp_path / 'part1')
+    part0.append('run3.nii.gz', tables['run3.nii.gz'])
+    part1.append('run2.nii.gz', tables['run2.nii.gz'])
+    part1.append('run1.nii.gz', tables['run1.nii.gz'])
+    store = MetricStore(tmp_path / 'store')
+    assert store.extend(part0) == 1
+    assert store.extend(part1) == 2
+    assert store.extend(part1) == 0
+    assert [run['fname'] for run in store.runs] == [
+        'run3.nii.gz', 'run1.nii.gz', 'run2.nii.gz']
+    for fname, table in tables.items():
+        assert np.all(store.run(fname)['dvars'] == table['dvars'])
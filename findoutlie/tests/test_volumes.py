@@ -0,0 +1,50 @@
+""" Test volumes module
+
+You can run the tests from the root directory (containing ``README.md``) with::
+
+    python3 -m pytest .
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+import nibabel as nib
+
+from findoutlie.volumes import (block_size_for, iter_volume_blocks,
+                                iter_volumes)
+
+MY_DIR = Path(__file__).parent
+EXAMPLE_FILENAME = MY_DIR / 'ds107_sub012_t1r2_small.nii'
+
+
+def test_block_size_for():
+    shape = (4, 5, 6, 100)
+    # 120 voxels per volume, 4 bytes per voxel.
+    assert block_size_for(shape, np.float32, 480 * 10) == 10
+    assert block_size_for(shape, np.float64, 480 * 10) == 5
+    # At least one volume, and at most all the volumes.
+    assert block_size_for(shape, np.float32, 1) == 1
+    assert block_size_for(shape, np.float32, 10 ** 9) == 100
+
+
+def test_iter_volume_blocks(tmp_path):
+    img = nib.load(EXAMPLE_FILENAME)
+    data = img.get_fdata()
+    gz_fname = tmp_path / 'example.nii.gz'
+    nib.save(img, str(gz_fname))
+    for source in (EXAMPLE_FILENAME, img, gz_fname):
+        blocks = list(iter_volume_blocks(source, block_size=7))
+        assert [b.shape[-1] for b in blocks[:-1]] == [7] * (len(blocks) - 1)
+        assert all(b.dtype == np.float32 for b in blocks)
+        assert np.allclose(np.concatenate(blocks, axis=-1), data)
+    vol_bytes = np.prod(img.shape[:-1]) * 8
+    blocks = list(iter_volume_blocks(img, memory_budget=vol_bytes * 3,
+                                     dtype=np.float64))
+    assert blocks[0].shape[-1] == 3
+    assert np.all(np.concatenate(blocks, axis=-1) == data)
+    blocks = list(iter_volume_blocks(img, dtype=None))
+    assert blocks[0].dtype == img.get_data_dtype()
+    vols = list(iter_volumes(img))
+    assert len(vols) == img.shape[-1]
+    assert np.allclose(vols[3], data[..., 3])
@@ -23,7 +23,7 @@ def test_file_hash_error():
 def test_validate_data():
     """Assert the validate_data function works for test data."""
     data_directory = Path(__file__).parent / 'test_files'
-    validate_data(data_directory)
+    validate_data(data_directory, use_cache=False)
     assert True
     
 def test_validate_data_error():
@@ -34,4 +34,121 @@ def test_validate_data_error():
     data_directory = Path(__file__).parent / 'test_files/group-xx'
     with pytest.raises(FileExistsError):
         validate_data(data_directory)
-    
\ No newline at end of file
+    
+
+def test_file_hash_blocks():
+    """Assert the hash does not depend on the block size."""
+    test_file = Path(__file__).parent / 'test_files' / 'test_sha.txt'
+    for block_size in (1, 7, 1024):
+        assert (file_hash(test_file, block_size=block_size) ==
+                'c58c0f19b254c3246f20cfbe2ba568ae498970ae')
+
+
+def test_validate_data_mismatches(tmp_path):
+    """Assert all mismatches are reported, serially and in parallel."""
+    group_dir = tmp_path / 'group-00'
+    group_dir.mkdir()
+    lines = []
+    for i in range(4):
+        (group_dir / f'file{i}.txt').write_text(f'contents {i}')
+        lines.append(f'{"0" * 40} group-00/file{i}.txt')
+    (group_dir / 'hash_list.txt').write_text('\n'.join(lines))
+    for n_workers in (1, 3):
+        with pytest.raises(ValueError) as excinfo:
+            validate_data(tmp_path, n_workers=n_workers)
+        message = str(excinfo.value)
+        assert 'for 4 file(s)' in message
+        for i in range(4):
+            assert f'group-00/file{i}.txt' in message
+    assert validate_data(Path(__file__).parent / 'test_files', n_workers=2,
+                         use_cache=False)
+
+
+def test_validate_data_cache(tmp_path, monkeypatch):
+    """Assert unchanged files are not hashed again unless `full` is set."""
+    from .. import utils
+    group_dir = tmp_path / 'group-00'
+    group_dir.mkdir()
+    test_file = group_dir / 'file.txt'
+    test_file.write_text('some contents')
+    (group_dir / 'hash_list.txt').write_text(
+        f'{file_hash(test_file)} group-00/file.txt')
+    hashed = []
+    original_file_hash = utils.file_hash
+
+    def counting_file_hash(filename, *args, **kwargs):
+        hashed.append(filename)
+        return original_file_hash(filename, *args, **kwargs)
+
+    monkeypatch.setattr(utils, 'file_hash', counting_file_hash)
+    assert validate_data(tmp_path)
+    assert len(hashed) == 1
+    assert (tmp_path / utils.HASH_CACHE_FNAME).exists()
+    assert validate_data(tmp_path)
+    assert len(hashed) == 1
+    assert validate_data(tmp_path, full=True)
+    assert len(hashed) == 2
+    # Changing the file (and so its size) invalidates the cache.
+    test_file.write_text('other contents, longer')
+    with pytest.raises(ValueError):
+        validate_data(tmp_path)
+    assert len(hashed) == 3
+
+
+def test_validate_data_read_only_cache(tmp_path, monkeypatch, caplog):
+    """Assert failing to write the cache does not fail validation."""
+    from .. import utils
+    group_dir = tmp_path / 'group-00'
+    group_dir.mkdir()
+    test_file = group_dir / 'file.txt'
+    test_file.write_text('some contents')
+    (group_dir / 'hash_list.txt').write_text(
+        f'{file_hash(test_file)} group-00/file.txt')
+
+    def failing_replace(src, dst):
+        raise PermissionError('Read-only file system')
+
+    monkeypatch.setattr(utils.os, 'replace', failing_replace)
+    assert validate_data(tmp_path)
+    assert 'Could not write hash cache' in caplog.text
+    assert not (tmp_path / utils.HASH_CACHE_FNAME).exists()
+    assert not (tmp_path / (utils.HASH_CACHE_FNAME + '.tmp')).exists()
+    monkeypatch.undo()
+    # Cache can go elsewhere.
+    cache_path = tmp_path / 'elsewhere' / 'cache.json'
+    cache_path.parent.mkdir()
+    assert validate_data(tmp_path, cache_path=cache_path)
+    assert cache_path.exists()
+    assert not (tmp_path / utils.HASH_CACHE_FNAME).exists()
+
+
+def test_validate_data_all_manifests(tmp_path, monkeypatch):
+    """Assert all manifests are merged, de-duplicated, largest file first."""
+    from .. import utils
+    lines = {}
+    for group, sizes in (('group-00', (10, 30)), ('group-01', (20,))):
+        (tmp_path / group).mkdir()
+        for size in sizes:
+            fname = tmp_path / group / f'file{size}.txt'
+            fname.write_text('x' * size)
+            lines.setdefault(group, []).append(
+                f'{file_hash(fname)} {group}/file{size}.txt')
+    # The same file listed in two manifests is only checked once.
+    lines['group-01'] += lines['group-00'][:1]
+    for group, group_lines in lines.items():
+        (tmp_path / group / 'hash_list.txt').write_text('\n'.join(group_lines))
+    hashed = []
+    original_file_hash = utils.file_hash
+
+    def recording_file_hash(filename, *args, **kwargs):
+        hashed.append(Path(filename).name)
+        return original_file_hash(filename, *args, **kwargs)
+
+    monkeypatch.setattr(utils, 'file_hash', recording_file_hash)
+    assert validate_data(tmp_path, use_cache=False)
+    assert hashed == ['file30.txt', 'file20.txt', 'file10.txt']
+    # Conflicting hashes for the same file are an error.
+    (tmp_path / 'group-01' / 'hash_list.txt').write_text(
+        f'{"0" * 40} group-00/file10.txt')
+    with pytest.raises(ValueError):
+        validate_data(tmp_path, use_cache=False)
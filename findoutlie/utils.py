@@ -2,10 +2,13 @@
 Example: file hashing and directory testing.
 """
 from pathlib import Path
-import numpy as np
-import sys
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
+import json
 import logging
+import os
+
+from . import profiling
 
 # Create and set up logger
 logger = logging.getLogger(__name__)
@@ -15,54 +18,229 @@ formatter = logging.Formatter('%(levelname)s | %(asctime)s | %(message)s')
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+# Read files in blocks of this many bytes when hashing.
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Name of file in data directory recording digests of already verified files.
+HASH_CACHE_FNAME = '.hash_cache.json'
 
-def file_hash(filename: str) -> str:
+
+def file_hash(filename: str, block_size: int = HASH_BLOCK_SIZE) -> str:
     """ Get byte contents of file `filename`, return SHA1 hash
 
+    The file is read in blocks of `block_size` bytes, so memory use does not
+    depend on the size of the file.
+
     Parameters
     ----------
     filename : str
         Name of file to read
+    block_size : int, optional
+        Number of bytes to read at a time.
 
     Returns
     -------
     hash : str
         SHA1 hexadecimal hash string for contents of `filename`.
     """
-    # Open the file, read contents as bytes.
-    # Calculate, return SHA1 has on the bytes from the file.
     filename = Path(filename)
     # Assert the file exists, if not raise an error
     if not filename.exists():
         logger.error(f'File {filename} does not exist')
         raise FileExistsError(f'File {filename} does not exist')
-    # Read the file as bytes and return SHA1 hash
-    return hashlib.sha1(filename.read_bytes()).hexdigest()
-    
+    # Feed the file to SHA1 block by block.
+    sha1 = hashlib.sha1()
+    with profiling.stage('hash', os.path.getsize(filename)):
+        with open(filename, 'rb') as fobj:
+            for block in iter(lambda: fobj.read(block_size), b''):
+                sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _stat_key(path):
+    """ Return stat metadata for `path` that must match for a cache hit
+    """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
 
-def validate_data(data_directory: str) -> None:
-    """ Read ``data_hashes.txt`` file in `data_directory`, check hashes
+
+def load_hash_cache(cache_path):
+    """ Load hash cache from JSON file `cache_path`
+
+    Parameters
+    ----------
+    cache_path : str
+        Path to JSON cache file.
+
+    Returns
+    -------
+    cache : dict
+        Dictionary with keys being filenames relative to the data directory
+        and values being dictionaries with ``stat`` (size, mtime in
+        nanoseconds, inode) and ``sha1`` keys.  Empty if the file does not
+        exist or cannot be read.
+    """
+    cache_path = Path(cache_path)
+    if not cache_path.exists():
+        return {}
+    try:
+        return json.loads(cache_path.read_text())
+    except ValueError:
+        logger.warning(f'Ignoring unreadable hash cache {cache_path}')
+        return {}
+
+
+def save_hash_cache(cache_path, cache):
+    """ Write hash cache dictionary `cache` to JSON file `cache_path`
+
+    The file is written to a temporary name and then moved into place, so an
+    interrupted run never leaves a truncated cache.  The cache only saves
+    time, so if it cannot be written, for example because the data is on a
+    read-only file system, log a warning and carry on.
+
+    Returns
+    -------
+    saved : bool
+        True if the cache was written.
+    """
+    cache_path = Path(cache_path)
+    tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+    try:
+        tmp_path.write_text(json.dumps(cache, indent=1, sort_keys=True))
+        os.replace(tmp_path, cache_path)
+    except OSError as err:
+        logger.warning(f'Could not write hash cache {cache_path}: {err}')
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def _check_hash(data_directory, expected_hash, filename, cache):
+    """ Check hash of `filename` against `expected_hash`
+
+    Returns
+    -------
+    message : str or None
+        Mismatch message, or None if the hash matches.
+    record : dict or None
+        Cache record for a matching file, or None for a mismatch.
+    """
+    path = data_directory / filename
+    stat_key = _stat_key(path)
+    record = cache.get(filename)
+    if (record is not None and record['stat'] == stat_key
+            and record['sha1'] == expected_hash):
+        logger.info(f'Hash match for {filename} (cached)')
+        return None, record
+    actual_hash = file_hash(path)
+    if actual_hash != expected_hash:
+        logger.error(f'Hash mismatch for {filename}: '
+                     f'{expected_hash} != {actual_hash}')
+        return f'{filename}: {expected_hash} != {actual_hash}', None
+    logger.info(f'Hash match for {filename}')
+    logger.debug(f'hash (sha1) = {expected_hash}')
+    return None, {'stat': stat_key, 'sha1': actual_hash}
+
+
+def read_manifests(data_directory):
+    """ Read all ``group-*/hash_list.txt`` files below `data_directory`
+
+    Each line of a ``hash_list.txt`` file has a SHA1 hash and a filename
+    relative to the directory containing the ``group-*`` directory.
+
+    Parameters
+    ----------
+    data_directory : str
+        Directory containing ``group-*/hash_list.txt`` files.
+
+    Returns
+    -------
+    entries : list
+        List of ``(hash, filename)`` tuples, with filenames relative to
+        `data_directory`, and each file only once.
+
+    Raises
+    ------
+    FileExistsError:
+        If there are no ``hash_list.txt`` files, or a listed file does not
+        exist.
+    ValueError:
+        If two manifests record different hashes for the same file.
+    """
+    data_directory = Path(data_directory)
+    manifests = sorted(data_directory.rglob('group-*/hash_list.txt'))
+    if len(manifests) == 0:
+        logger.error(f'No group-*/hash_list.txt in {data_directory}')
+        raise FileExistsError(f'No group-*/hash_list.txt in {data_directory}')
+    hashes = {}
+    for manifest in manifests:
+        root = manifest.parent.parent
+        for line in manifest.read_text().splitlines():
+            if not line.strip():
+                continue
+            hash1, filename = line.split()
+            path = root / filename
+            if not path.exists():
+                logger.error(f'File {path} does not exist')
+                raise FileExistsError(f'File {path} does not exist')
+            rel_name = path.relative_to(data_directory).as_posix()
+            if hashes.setdefault(rel_name, hash1) != hash1:
+                raise ValueError(f'Different hashes recorded for {rel_name}: '
+                                 f'{hashes[rel_name]} != {hash1}')
+    return [(hash1, rel_name) for rel_name, hash1 in hashes.items()]
+
+
+def validate_data(data_directory: str,
+                  n_workers: int = 1,
+                  full: bool = False,
+                  use_cache: bool = True,
+                  profile_callback=None,
+                  cache_path=None) -> bool:
+    """ Read ``hash_list.txt`` files in `data_directory`, check hashes
+
+    All ``group-*/hash_list.txt`` files below `data_directory` are read and
+    merged, and each listed file is checked once, largest files first.
+
+    Digests of files that match are recorded in a ``.hash_cache.json`` file
+    in `data_directory` (or in `cache_path`), together with the file size,
+    modification time and inode.  On later runs, files whose size,
+    modification time and inode have not changed are not hashed again.  If the
+    cache cannot be written, we log a warning; validation still succeeds.
 
     Parameters
     ----------
     data_directory : str
-        Directory containing data and ``data_hashes.txt`` file.
+        Directory containing data and ``group-*/hash_list.txt`` files.
+    n_workers : int, optional
+        Number of threads used to hash files.  Hashing releases the GIL, so
+        values above 1 let reads and hashing of several files overlap.
+        Default is 1 (hash files one after another).
+    full : bool, optional
+        If True, ignore cached digests and hash every file.  The cache is
+        still updated.
+    use_cache : bool, optional
+        If False, neither read nor write the hash cache.
+    profile_callback : callable, optional
+        If given, profile checking each file, and call
+        ``profile_callback(summary)`` with the profile summary for each file.
+        See :mod:`findoutlie.profiling`.
+    cache_path : str, optional
+        Path of hash cache file.  Default is ``.hash_cache.json`` in
+        `data_directory`.  Use this when `data_directory` is read-only.
 
     Returns
     -------
-    None
+    True
 
     Raises
     ------
     ValueError:
         If hash value for any file is different from hash value recorded in
-        ``data_hashes.txt`` file.
+        ``hash_list.txt`` file.  The message lists all mismatching files.
     """
-    # Read lines from ``hash_lists.txt`` file.
-    # Split into SHA1 hash and filename
-    # Calculate actual hash for given filename.
-    # If hash for filename is not the same as the one in the file, raise
-    # ValueError
     data_directory = Path(data_directory)
     if not data_directory.exists():
         logger.error(f'Directory {data_directory} does not exist')
@@ -70,23 +248,41 @@ def validate_data(data_directory: str) -> None:
     if not data_directory.is_dir():
         logger.error(f'{data_directory} is not a directory')
         raise NotADirectoryError(f'{data_directory} is not a directory')
-    # Read the data_hashes.txt file
-    data_hashes = next(data_directory.rglob('group-*/hash_list.txt'), None)
-    if data_hashes is None:
-        logger.error(f'{data_hashes} does not exist')
-        raise FileExistsError(f'{data_hashes} does not exist')
-    # Loop through the lines of the data_hashes.txt file. The file contents are composed as:
-    # hash1 filename. Split and use the file_hash function to calculate the hash of the filename.
-    for line in data_hashes.read_text().splitlines():
-        hash1, filename = line.split()
-        hash2 = file_hash(data_directory / filename)
-        if hash1 != hash2:
-            logger.error(f'Hash mismatch for {filename}: '
-                           f'{hash1} != {hash2}')
-            raise ValueError(f'Hash mismatch for {filename}: '
-                             f'{hash1} != {hash2}')                     
+    entries = read_manifests(data_directory)
+    # Largest files first, so no big file is left to finish on its own.
+    entries.sort(key=lambda entry: -(data_directory / entry[1]).stat().st_size)
+    if cache_path is None:
+        cache_path = data_directory / HASH_CACHE_FNAME
+    cache = load_hash_cache(cache_path) if use_cache and not full else {}
+
+    def check(entry):
+        with profiling.file_profile(entry[1]) as file_prof:
+            result = _check_hash(data_directory, *entry, cache)
+        return result, file_prof
+
+    was_enabled = profiling.is_enabled()
+    profiling.enable(was_enabled or profile_callback is not None)
+    try:
+        if n_workers > 1:
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                results = list(executor.map(check, entries))
+        else:
+            results = [check(entry) for entry in entries]
+    finally:
+        profiling.enable(was_enabled)
+    mismatches = []
+    new_cache = {}
+    for (expected_hash, filename), ((message, record), file_prof) in zip(
+            entries, results):
+        if profile_callback is not None:
+            profile_callback(file_prof.summary())
+        if message is None:
+            new_cache[filename] = record
         else:
-            logger.info(f'Hash match for {filename}') 
-            logger.debug(f'hash (sha1) = {hash1}')
+            mismatches.append(message)
+    if use_cache:
+        save_hash_cache(cache_path, new_cache)
+    if mismatches:
+        raise ValueError(f'Hash mismatch for {len(mismatches)} file(s):\n'
+                         + '\n'.join(mismatches))
     return True
-
@@ -0,0 +1,145 @@
+""" Read 4D images a block of volumes at a time
+
+Reading the whole of a 4D image with ``img.get_fdata()`` gives a float64 array
+that can be many times the size of the file on disk.  The routines here read a
+few volumes at a time from the image ``dataobj``, so memory use depends on the
+block size, not on the number of volumes.
+"""
+
+import os
+
+import numpy as np
+
+import nibabel as nib
+
+from . import profiling
+from .loader import load_image, is_loaded
+from .prefetch import prefetch as prefetch_items
+
+# Default maximum size in bytes of one block of volumes.
+DEFAULT_MEMORY_BUDGET = 64 * 1024 ** 2
+
+
+def open_image(img):
+    """ Return image for filename or image `img`, ready for block reads
+
+    Images read from ``.nii.gz`` files reopen and decompress the file from the
+    start on each slice of ``img.dataobj``, unless the image keeps its file
+    open.  We load filenames, and reload images with data still on disk, with
+    :func:`findoutlie.loader.load_image`, which keeps the file open, so
+    reading successive blocks is one pass through the file.  Images that
+    already came from :func:`findoutlie.loader.load_image` are returned
+    unchanged, so opening an opened image does not load it again.
+
+    Parameters
+    ----------
+    img : str or nibabel image
+        Filename of 4D image, or 4D nibabel image.
+
+    Returns
+    -------
+    img : nibabel image
+    """
+    if isinstance(img, (str, os.PathLike)):
+        return load_image(img)
+    if is_loaded(img):
+        return img
+    fname = img.get_filename()
+    if fname is not None and not img.in_memory and nib.is_proxy(img.dataobj):
+        return load_image(fname)
+    return img
+
+
+def block_size_for(shape, dtype, memory_budget=None):
+    """ Number of volumes per block for image of `shape` and `dtype`
+
+    Parameters
+    ----------
+    shape : sequence
+        Shape of 4D image.
+    dtype : dtype
+        Data type of blocks.
+    memory_budget : int, optional
+        Maximum size in bytes of one block.  Default is
+        ``DEFAULT_MEMORY_BUDGET``.  There is always at least one volume per
+        block.
+
+    Returns
+    -------
+    block_size : int
+        Number of volumes per block.
+    """
+    if memory_budget is None:
+        memory_budget = DEFAULT_MEMORY_BUDGET
+    vol_bytes = int(np.prod(shape[:-1])) * np.dtype(dtype).itemsize
+    return int(min(max(memory_budget // vol_bytes, 1), shape[-1]))
+
+
+def iter_volume_blocks(img, block_size=None, memory_budget=None,
+                       dtype=np.float32, prefetch=0):
+    """ Iterate over blocks of consecutive volumes in 4D image `img`
+
+    Parameters
+    ----------
+    img : str or nibabel image
+        Filename of 4D image, or 4D nibabel image.
+    block_size : int, optional
+        Number of volumes in each block.  Default is set from
+        `memory_budget`.
+    memory_budget : int, optional
+        Maximum size in bytes of one block, used if `block_size` is not set.
+        See :func:`block_size_for`.
+    dtype : dtype or None, optional
+        Data type of blocks.  None gives the data type of the image array
+        proxy, that is the on-disk type for images without scaling.
+    prefetch : int, optional
+        If more than 0, read up to this many blocks ahead in a background
+        thread, while the caller works on the current block.  Up to
+        ``prefetch + 2`` blocks can be in memory at once.  See
+        :func:`findoutlie.prefetch.prefetch`.
+
+    Yields
+    ------
+    block : 4D array
+        Next block of volumes, with volumes on the last axis.  The last block
+        can have fewer volumes than the others.
+    """
+    img = open_image(img)
+    blocks = _read_blocks(img, block_size, memory_budget, dtype)
+    yield from prefetch_items(blocks, prefetch)
+
+
+def _read_blocks(img, block_size, memory_budget, dtype):
+    """ Yield blocks of volumes read from opened image `img`
+    """
+    shape = img.shape
+    block_dtype = np.dtype(img.get_data_dtype() if dtype is None else dtype)
+    if block_size is None:
+        block_size = block_size_for(shape, block_dtype, memory_budget)
+    vol_bytes = int(np.prod(shape[:-1])) * block_dtype.itemsize
+    for start in range(0, shape[-1], block_size):
+        n_vols = min(block_size, shape[-1] - start)
+        # Reading includes any decompression.
+        with profiling.stage('read', n_vols * vol_bytes):
+            block = img.dataobj[..., start:start + block_size]
+            block = np.asarray(block, dtype=dtype)
+        yield block
+
+
+def iter_volumes(img, dtype=np.float32):
+    """ Iterate over 3D volumes in 4D image `img`, one at a time
+
+    Parameters
+    ----------
+    img : str or nibabel image
+        Filename of 4D image, or 4D nibabel image.
+    dtype : dtype or None, optional
+        Data type of volumes.  See :func:`iter_volume_blocks`.
+
+    Yields
+    ------
+    vol : 3D array
+        Next volume.
+    """
+    for block in iter_volume_blocks(img, block_size=1, dtype=dtype):
+        yield block[..., 0]
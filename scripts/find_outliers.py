@@ -3,29 +3,170 @@
 Run as:
 
     python3 scripts/find_outliers.py data
+
+To split the work across several jobs, run each shard with its own output
+file, then merge the output files:
+
+    python3 scripts/find_outliers.py data --shard 0/2 --output part0.jsonl
+    python3 scripts/find_outliers.py data --shard 1/2 --output part1.jsonl
+    python3 scripts/find_outliers.py merge part0.jsonl part1.jsonl
 """
 
 from pathlib import Path
+from contextlib import ExitStack
+import json
+import os
 import sys
 
-from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from argparse import (ArgumentParser, ArgumentTypeError,
+                      RawDescriptionHelpFormatter)
 
 # Put the findoutlie directory on the Python path.
 PACKAGE_DIR = Path(__file__).parent / '..'
 sys.path.append(str(PACKAGE_DIR))
 
-from findoutlie import outfind
+# Import findoutlie modules, and so numpy and nibabel, only when needed, so
+# --help and argument errors are quick.
+
+# Names of detectors in findoutlie.detectors.DETECTORS.
+DETECTOR_NAMES = ('iqr', 'mad', 'mean_std')
+
+# Methods in findoutlie.metrics.PCA_METHODS.
+PCA_METHODS = ('eigh', 'power')
+
+
+def read_done(output_fname):
+    """ Return filenames with outliers recorded in JSONL file `output_fname`
+
+    Images with errors are not done, so a new run tries them again, in case
+    the error was temporary.  A last line without a newline is from an
+    interrupted run; remove it, so new lines can be appended.
+    """
+    output_path = Path(output_fname)
+    if not output_path.exists():
+        return set()
+    contents = output_path.read_bytes()
+    complete = contents[:contents.rfind(b'\n') + 1]
+    if len(complete) < len(contents):
+        output_path.write_bytes(complete)
+    records = [json.loads(line) for line in complete.decode().splitlines()
+               if line.strip()]
+    return {record['fname'] for record in records if 'outliers' in record}
+
+
+def read_records(fname):
+    """ Return list of complete records in JSONL output file `fname`
+    """
+    contents = Path(fname).read_text()
+    complete = contents[:contents.rfind('\n') + 1]
+    return [json.loads(line) for line in complete.splitlines()
+            if line.strip()]
+
+
+def print_record(record):
+    """ Print result `record` for one image, if it has outliers or an error
+    """
+    fname = record['fname']
+    if 'error' in record:
+        print(f"{fname}: error: {record['error']}", file=sys.stderr)
+    elif len(record['outliers']):
+        outlier_strs = [str(out_ind) for out_ind in record['outliers']]
+        print(', '.join([fname] + outlier_strs), flush=True)
+
+
+def merge_outputs(fragments, output=None):
+    """ Merge JSONL output files `fragments` into one report
+
+    Print the results for all images in filename order, and write them to
+    `output`, if given.  A file can have an error and then outliers for the
+    same image, from a run that tried the image again; outliers replace
+    errors, and later errors replace earlier errors.
+    """
+    records = {}
+    for fragment in fragments:
+        for record in read_records(fragment):
+            previous = records.setdefault(record['fname'], record)
+            if 'error' in previous:
+                records[record['fname']] = record
+            elif 'outliers' in record and previous != record:
+                raise ValueError(f"Different results for {record['fname']} "
+                                 f'in {fragment} and an earlier file')
+    with ExitStack() as stack:
+        out_file = None
+        if output is not None:
+            out_file = stack.enter_context(open(output, 'w'))
+        for fname in sorted(records):
+            print_record(records[fname])
+            if out_file is not None:
+                out_file.write(json.dumps(records[fname]) + '\n')
+
 
+def shard_store_dir(store_dir, shard):
+    """ Return directory for metric store of `shard` within `store_dir`
 
-def print_outliers(data_directory):
-    outlier_dict = outfind.find_outliers(data_directory)
-    for fname, outliers in outlier_dict.items():
-        if len(outliers) == 0:
-            continue
-        outlier_strs = []
-        for out_ind in outliers:
-            outlier_strs.append(str(out_ind))
-        print(', '.join([fname] + outlier_strs))
+    Shards running at the same time must not add to the same store, so each
+    shard has its own store, to combine with :func:`merge_stores`.
+    """
+    index, n_shards = shard
+    return Path(store_dir) / f'shard-{index}-of-{n_shards}'
+
+
+def merge_stores(store_dir):
+    """ Add runs from shard stores in `store_dir` to the store in `store_dir`
+    """
+    from findoutlie.store import MetricStore
+
+    store = MetricStore(store_dir)
+    for shard_dir in sorted(Path(store_dir).glob('shard-*-of-*')):
+        store.extend(MetricStore(shard_dir))
+
+
+def parse_shard(shard_str):
+    """ Return ``(index, n_shards)`` for string of form ``index/n_shards``
+    """
+    try:
+        index, n_shards = [int(part) for part in shard_str.split('/')]
+    except ValueError:
+        raise ArgumentTypeError(f'Shard {shard_str} is not of form i/N')
+    if not 0 <= index < n_shards:
+        raise ArgumentTypeError(
+            f'Shard index should be in 0 to N-1 for {shard_str}')
+    return index, n_shards
+
+
+def print_outliers(data_directory, n_jobs=1, detector='mean_std',
+                   cache=None, store=None, output=None, profile=None,
+                   mask=None, shard=None, prefetch=0, pca_method='eigh'):
+    from findoutlie import outfind
+    from findoutlie.detectors import DETECTORS
+
+    done = set() if output is None else read_done(output)
+    with ExitStack() as stack:
+        out_file = None
+        if output is not None:
+            out_file = stack.enter_context(open(output, 'a'))
+        profile_callback = None
+        if profile is not None:
+            profile_file = stack.enter_context(open(profile, 'w'))
+
+            def profile_callback(summary):
+                profile_file.write(json.dumps(summary) + '\n')
+                profile_file.flush()
+
+        for fname, outliers in outfind.iter_outliers(
+                data_directory, n_jobs=n_jobs, detector=DETECTORS[detector],
+                cache=cache, store=store, skip=done,
+                profile_callback=profile_callback, mask=mask, shard=shard,
+                prefetch=prefetch, pca_method=pca_method):
+            if isinstance(outliers, Exception):
+                record = {'fname': fname, 'error': str(outliers)}
+            else:
+                record = {'fname': fname,
+                          'outliers': [int(i) for i in outliers]}
+            print_record(record)
+            if out_file is not None:
+                out_file.write(json.dumps(record) + '\n')
+                out_file.flush()
 
 
 def get_parser():
@@ -33,6 +174,58 @@ def get_parser():
                             formatter_class=RawDescriptionHelpFormatter)
     parser.add_argument('data_directory',
                         help='Directory containing data')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of processes to use')
+    parser.add_argument('--detector', choices=DETECTOR_NAMES,
+                        default='mean_std',
+                        help='Outlier detection rule')
+    parser.add_argument('--cache-dir',
+                        help='Directory for cache of image metrics')
+    parser.add_argument('--cache-max-mb', type=float, default=1024,
+                        help='Maximum size of metric cache in MB')
+    parser.add_argument('--store',
+                        help='Directory of metric store to add metrics to.  '
+                        'With --shard, add to a store for the shard within '
+                        'this directory; combine these with merge --store')
+    parser.add_argument('--output',
+                        help='JSON lines file to write results to, one line '
+                        'per image.  If the file exists, skip the images '
+                        'already in the file, and add the rest')
+    parser.add_argument('--scratch-dir',
+                        help='Directory for decompressed copies of images, '
+                        'to reuse on later runs')
+    parser.add_argument('--profile',
+                        help='JSON lines file to write time taken by each '
+                        'stage for each image to')
+    parser.add_argument('--mask', action='store_true',
+                        help='Only use voxels in a brain mask made from the '
+                        'mean of the first block of volumes')
+    parser.add_argument('--shard', type=parse_shard,
+                        help='Only analyse shard i of N (i from 0 to N-1), '
+                        'as i/N.  Shards have about the same total file '
+                        'size.  Combine outputs with the merge command')
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help='Number of blocks of volumes to read ahead in a '
+                        'background thread, while calculating metrics.  '
+                        'Each block is up to 64 MB')
+    parser.add_argument('--pca-method', choices=PCA_METHODS, default='eigh',
+                        help='Method for the largest eigenvalue in the PCA '
+                        'variance metric.  Power iteration can be faster '
+                        'for images with many slices')
+    return parser
+
+
+def get_merge_parser():
+    parser = ArgumentParser(
+        prog='find_outliers.py merge',
+        description='Merge output files from find_outliers.py shards')
+    parser.add_argument('fragments', nargs='+',
+                        help='JSON lines output files to merge')
+    parser.add_argument('--output',
+                        help='JSON lines file to write merged results to')
+    parser.add_argument('--store',
+                        help='Directory of metric store given to the shards; '
+                        'add the metrics from the shard stores to this store')
     return parser
 
 
@@ -40,10 +233,41 @@ def main():
     # This function (main) called when this file run as a script.
     #
     # Get the data directory from the command line arguments
+    if sys.argv[1:2] == ['merge']:
+        args = get_merge_parser().parse_args(sys.argv[2:])
+        merge_outputs(args.fragments, args.output)
+        if args.store is not None:
+            merge_stores(args.store)
+        return
     parser = get_parser()
     args = parser.parse_args()
+    from findoutlie.cache import MetricCache
+    from findoutlie.loader import SCRATCH_ENV_VAR
+    from findoutlie.store import MetricStore
+
+    cache = None
+    if args.cache_dir is not None:
+        cache = MetricCache(args.cache_dir,
+                            max_bytes=int(args.cache_max_mb * 1024 ** 2))
+    store = None
+    if args.store is not None:
+        store = MetricStore(args.store if args.shard is None else
+                            shard_store_dir(args.store, args.shard))
+    if args.scratch_dir is not None:
+        # Environment variable also applies to worker processes.
+        os.environ[SCRATCH_ENV_VAR] = args.scratch_dir
     # Call function to find outliers.
-    print_outliers(args.data_directory)
+    print_outliers(args.data_directory,
+                   n_jobs=args.jobs,
+                   detector=args.detector,
+                   cache=cache,
+                   store=store,
+                   output=args.output,
+                   profile=args.profile,
+                   mask='auto' if args.mask else None,
+                   shard=args.shard,
+                   prefetch=args.prefetch,
+                   pca_method=args.pca_method)
 
 
 if __name__ == '__main__':
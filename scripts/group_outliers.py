@@ -0,0 +1,62 @@
+""" Python script to find outlier runs and subjects in a metric store
+
+Run as:
+
+    python3 scripts/find_outliers.py data --store metric_store
+    python3 scripts/group_outliers.py metric_store
+
+Prints lines of form:
+
+    run, <filename>, <summary>, <summary>, ...
+    subject, <subject>, <summary>, ...
+
+for runs and subjects with outlying summaries of the per-volume metrics, such
+as ``dvars_mean``, compared to the other runs and subjects in the store.
+"""
+
+from pathlib import Path
+import sys
+
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+
+# Put the findoutlie directory on the Python path.
+PACKAGE_DIR = Path(__file__).parent / '..'
+sys.path.append(str(PACKAGE_DIR))
+
+# Names of detectors in findoutlie.detectors.DETECTORS.
+DETECTOR_NAMES = ('iqr', 'mad', 'mean_std')
+
+
+def print_group_outliers(store_dir, detector='iqr'):
+    from findoutlie.detectors import DETECTORS
+    from findoutlie.group import group_outliers
+    from findoutlie.store import MetricStore
+
+    run_outliers, subject_outliers = group_outliers(
+        MetricStore(store_dir), detector=DETECTORS[detector])
+    for kind, outliers in (('run', run_outliers),
+                           ('subject', subject_outliers)):
+        for label, summary_names in outliers.items():
+            print(', '.join([kind, label] + summary_names))
+
+
+def get_parser():
+    parser = ArgumentParser(description=__doc__,  # Usage from docstring
+                            formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument('store_dir',
+                        help='Directory of metric store')
+    parser.add_argument('--detector', choices=DETECTOR_NAMES,
+                        default='iqr',
+                        help='Outlier detection rule')
+    return parser
+
+
+def main():
+    # This function (main) called when this file run as a script.
+    args = get_parser().parse_args()
+    print_group_outliers(args.store_dir, args.detector)
+
+
+if __name__ == '__main__':
+    # Python is running this file as a script, not importing it.
+    main()
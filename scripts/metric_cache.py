@@ -0,0 +1,60 @@
+""" Python script to inspect and prune the cache of image metrics
+
+Run as:
+
+    python3 scripts/metric_cache.py info
+    python3 scripts/metric_cache.py prune --max-mb 500
+    python3 scripts/metric_cache.py clear
+"""
+
+from pathlib import Path
+import sys
+import time
+
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+
+# Put the findoutlie directory on the Python path.
+PACKAGE_DIR = Path(__file__).parent / '..'
+sys.path.append(str(PACKAGE_DIR))
+
+from findoutlie.cache import MetricCache, DEFAULT_CACHE_DIR
+
+
+def print_info(cache):
+    entries = cache.entries()
+    total = sum(size for path, size, last_used in entries)
+    print(f'Cache directory: {cache.directory}')
+    print(f'{len(entries)} entries, {total / 1024 ** 2:.1f} MB')
+    for path, size, last_used in entries:
+        when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_used))
+        print(f'{path.name}  {size / 1024:.1f} kB  last used {when}')
+
+
+def get_parser():
+    parser = ArgumentParser(description=__doc__,  # Usage from docstring
+                            formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['info', 'prune', 'clear'],
+                        help='What to do with the cache')
+    parser.add_argument('--cache-dir', default=str(DEFAULT_CACHE_DIR),
+                        help='Directory for cache of image metrics')
+    parser.add_argument('--max-mb', type=float, default=1024,
+                        help='Maximum size of cache in MB, for "prune"')
+    return parser
+
+
+def main():
+    # This function (main) called when this file run as a script.
+    parser = get_parser()
+    args = parser.parse_args()
+    cache = MetricCache(args.cache_dir)
+    if args.command == 'info':
+        print_info(cache)
+        return
+    max_bytes = 0 if args.command == 'clear' else int(args.max_mb * 1024 ** 2)
+    removed = cache.prune(max_bytes)
+    print(f'Removed {len(removed)} entries')
+
+
+if __name__ == '__main__':
+    # Python is running this file as a script, not importing it.
+    main()
@@ -5,12 +5,9 @@ Run as:
     python3 scripts/validate_data.py data
 """
 
-import sys
-import hashlib
+import json
 import logging
-import os
-import glob
-from pathlib import Path
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
 
 from findoutlie.utils import validate_data
 
@@ -23,18 +20,45 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 
+def get_parser():
+    parser = ArgumentParser(description=__doc__,  # Usage from docstring
+                            formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument('data_directory',
+                        help='Directory containing data')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of threads to use for hashing files')
+    parser.add_argument('--full', action='store_true',
+                        help='Hash all files, ignoring cached digests')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Do not read or write the cache of digests')
+    parser.add_argument('--cache-path',
+                        help='File for cache of digests.  Default is '
+                        '.hash_cache.json in the data directory')
+    parser.add_argument('--profile',
+                        help='JSON lines file to write time taken for each '
+                        'file to')
+    return parser
+
+
 def main():
     # This function (main) called when this file run as a script.
     #
     # Get the data directory from the command line arguments
-    if len(sys.argv) < 2:
-        logger.error("Please give data directory on "
-                     "command line")
-        raise RuntimeError("Please give data directory on "
-                           "command line")
-    data_directory = sys.argv[1]
+    parser = get_parser()
+    args = parser.parse_args()
+    options = dict(n_workers=args.workers,
+                   full=args.full,
+                   use_cache=not args.no_cache,
+                   cache_path=args.cache_path)
     # Call function to validate data in data directory
-    validate_data(data_directory)
+    if args.profile is None:
+        validate_data(args.data_directory, **options)
+        return
+    with open(args.profile, 'w') as profile_file:
+        validate_data(args.data_directory,
+                      profile_callback=lambda summary: profile_file.write(
+                          json.dumps(summary) + '\n'),
+                      **options)
 
 
 if __name__ == '__main__':